@@ -0,0 +1 @@
+default_app_config = 'dteditor2.apps.Dteditor2Config'
@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class Dteditor2Config(AppConfig):
     name = 'dteditor2'
+
+    def ready(self):
+        """起動時に、コマンドを登録しておく.
+
+        最初のリクエストで、コマンド用モジュールを読み込まずにすむ
+
+        """
+        from .utils import editor
+        editor.command.load_commands()
@@ -0,0 +1,134 @@
+"""ASGIで動かす時の、非同期ビューのモジュール.
+
+settings.EDITOR_ASYNC が True の時に、urls.pyから使われます。
+Django 4.2以上と、uvicorn等のASGIサーバーが必要です。
+
+uvicorn project.asgi:application
+
+editorは全てのリクエストで共有しているので、エディタを更新する処理は
+今まで通り1つのスレッドで順番に行います(sync_to_asyncのthread_sensitive)。
+画像やダウンロードのファイル読み込みは別のスレッドで並行に行い、
+出力エリアはServer-Sent Eventsで、エディタのスレッドを使わずに配信します。
+
+"""
+import asyncio
+import base64
+import json
+
+from asgiref.sync import sync_to_async
+import cmdpr
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import render
+
+from . import views
+
+
+async def home(request):
+    """/ アクセスで呼び出されるビュー."""
+    return await sync_to_async(views.home)(request)
+
+
+async def history(request):
+    """/history コマンド履歴の検索で呼び出されるビュー."""
+    return await sync_to_async(views.history)(request)
+
+
+async def upload(request):
+    """/upload ファイルの分割アップロードで呼び出されるビュー.
+
+    リクエストボディの書き込みは、エディタとは別のスレッドで行います。
+
+    """
+    view = views.UploadView.as_view()
+    return await sync_to_async(view, thread_sensitive=False)(request)
+
+
+def render_img(request, path):
+    """画像を読み込み、base64にして描画したレスポンスを返す."""
+    try:
+        with open(path, 'rb') as file:
+            src = file.read()
+    except FileNotFoundError:
+        raise Http404('img Not Found')
+    context = {
+        'img_src': base64.b64encode(src),
+        'img_path': path,
+    }
+    return render(request, 'dteditor2/img.html', context)
+
+
+async def img(request, path):
+    """/img 画像ファイルクリックで呼び出されるビュー.
+
+    大きな画像の読み込み・エンコード・描画は、別のスレッドで行います。
+
+    """
+    return await sync_to_async(render_img, thread_sensitive=False)(
+        request, path)
+
+
+async def read_file_range(file, start, length, chunk_size):
+    """views.read_file_rangeの非同期版。読み込みは別のスレッドで行う."""
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(start)
+        while length > 0:
+            data = await read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+async def download(request, path):
+    """/download/path ファイルのダウンロードで呼び出されるビュー.
+
+    ファイルを開く処理も、別のスレッドで行います。
+
+    """
+    build = sync_to_async(
+        views.build_download_response, thread_sensitive=False)
+    return await build(request, path, read_file_range)
+
+
+async def output(request):
+    """/output 出力エリアの内容を、Server-Sent Eventsで配信するビュー.
+
+    ?since=N: N行目以降の出力を配信する
+    出力が削除された時(deletelog)は、resetイベントを送ります。
+
+    切断したクライアントへの配信が残り続けないように、EDITOR_SSE_TIMEOUT秒で
+    配信を終えます。ブラウザは自動で再接続し、Last-Event-IDの続きから配信します。
+
+    """
+    since = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('since')
+    try:
+        sent = int(since or 0)
+    except ValueError:
+        sent = 0
+
+    async def events():
+        nonlocal sent
+        # 出力の取得に、エディタを更新するスレッドは使わない
+        get_output = sync_to_async(cmdpr.get_output, thread_sensitive=False)
+        loop = asyncio.get_running_loop()
+        end_time = loop.time() + settings.EDITOR_SSE_TIMEOUT
+        while True:
+            lines = list(await get_output(0))
+            if len(lines) < sent:
+                yield 'event: reset\nid: 0\ndata: \n\n'
+                sent = 0
+            for line in lines[sent:]:
+                sent += 1
+                yield f'id: {sent}\ndata: {json.dumps(str(line))}\n\n'
+            if loop.time() >= end_time:
+                break
+            await asyncio.sleep(settings.EDITOR_SSE_INTERVAL)
+
+    response = StreamingHttpResponse(
+        events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
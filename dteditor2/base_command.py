@@ -16,12 +16,16 @@ DOSなどの元々のコマンド
 不具合が起きたら、このアプリを一旦終了して再起動してください
 
 """
+from datetime import datetime
+import errno
 import os
 import shutil
 import sys
 
 import cmdpr
-from dteditor2 import utils
+from django.conf import settings
+from dteditor2 import fileops, profiling, utils
+from dteditor2.dupes import find_duplicates
 from dteditor2.utils import editor as edt
 
 
@@ -42,6 +46,8 @@ def save(editor, file_name=None):
         else:
             with open(file_path, 'wb') as file:
                 file.write(binary_code)
+            editor.buffers.mark_saved(file_path, code, editor.open_encoding)
+            record_revision(editor, file_path, binary_code)
             cmdpr.add_line(f'新しく保存しました {file_path}')
 
             # 新規作成後、そのファイルを開く
@@ -50,11 +56,21 @@ def save(editor, file_name=None):
     elif not file_name and editor.opening_file:
         with open(editor.opening_file, 'wb') as file:
             file.write(binary_code)
+        editor.buffers.mark_saved(
+            editor.opening_file, code, editor.open_encoding)
+        record_revision(editor, editor.opening_file, binary_code)
         cmdpr.add_line(f'上書き保存しました {editor.opening_file}')
     else:
         cmdpr.add_line(f'ファイル名を指定するか、ファイルを開いてください')
 
 
+def record_revision(editor, file_path, binary_code):
+    """保存した内容をリビジョンとして記録し、古いリビジョンの削除を予約する."""
+    editor.tree.touch()  # ファイルのサイズ・更新日時の表示を更新する
+    editor.revisions.record(file_path, binary_code, editor.save_encoding)
+    editor.revisions.schedule_gc()
+
+
 @edt.command.register
 def deletelog(editor):
     """出力を一度削除する."""
@@ -65,7 +81,7 @@ def deletelog(editor):
 @edt.command.register
 def deletecmd(editor):
     """コマンド履歴の削除."""
-    del editor.command.command_history[:]
+    editor.command.command_history.clear()
 
 
 @edt.command.register
@@ -80,9 +96,19 @@ def cd(editor, dir_path):
 
 
 @edt.command.register
-def history(editor):
-    """コマンド履歴の表示."""
-    for cmd in editor.command.command_history:
+def history(editor, query=None):
+    """コマンド履歴の表示.
+
+    history: 全てのコマンド履歴を古い順に表示
+    history git: gitで始まるコマンド履歴を、新しい順に表示
+
+    """
+    if query:
+        commands = editor.command.command_history.search(
+            query, limit=settings.EDITOR_HISTORY_SEARCH_LIMIT)
+    else:
+        commands = editor.command.command_history
+    for cmd in commands:
         cmdpr.add_line(cmd)
 
 
@@ -111,15 +137,32 @@ def mv2(editor, before, after):
 
     mv2 before after: beforeをafterに変更
 
+    別のファイルシステムへの移動は、バックグラウンドでコピーした後に削除します。
+    進捗は出力エリアに表示され、jobsコマンドでも確認できます。
+    スクリプトの中では、コピーが終わってから次のコマンドを実行します。
+
     """
     before_path = os.path.join(editor.current_dir, before)
     after_path = os.path.join(editor.current_dir, after)
 
     if not os.path.exists(before_path):
         cmdpr.add_line(f'名前が見当たらないです {before_path}')
+        return False
     else:
-        shutil.move(before_path, after_path)
-        cmdpr.add_line(f'mvしました {before}→{after}')
+        # 既にあるディレクトリへの移動は、その中へ。中断した移動の続きを除く
+        if (os.path.isdir(after_path) and
+                not fileops.is_unfinished(before_path, after_path)):
+            after_path = os.path.join(
+                after_path, os.path.basename(before_path))
+        try:
+            os.rename(before_path, after_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # 別のファイルシステムへの移動
+            return fileops.CopyJob(before_path, after_path, move=True).start()
+        else:
+            cmdpr.add_line(f'mvしました {before}→{after}')
 
 
 @edt.command.register
@@ -128,21 +171,43 @@ def cp2(editor, before, after):
 
     cp2 origin new:  originをnewへコピー
 
+    ディレクトリと大きなファイルのコピーはバックグラウンドで、複数のスレッドで行います。
+    進捗は出力エリアに表示され、jobsコマンドでも確認できます。
+    途中で中断した場合は、同じコマンドを再実行すると続きからコピーします。
+    スクリプトの中では、コピーが終わってから次のコマンドを実行します。
+
     """
     before_path = os.path.join(editor.current_dir, before)
     after_path = os.path.join(editor.current_dir, after)
 
     if not os.path.exists(before_path):
         cmdpr.add_line(f'名前が見当たらないです {before_path}')
+        return False
     else:
-        # ファイルのコピー
-        if os.path.isfile(before_path):
-            shutil.copy(before_path, after_path)
-        # でぃれくとりのコピー
+        # 既にあるディレクトリへのコピーは、その中へ。中断したコピーの続きを除く
+        if (os.path.isdir(after_path) and
+                not fileops.is_unfinished(before_path, after_path)):
+            after_path = os.path.join(
+                after_path, os.path.basename(before_path))
+        job = fileops.CopyJob(before_path, after_path)
+
+        # 小さなファイル1つは、次のコマンドですぐ使えるようにその場でコピー
+        sync_size = settings.EDITOR_COPY_SYNC_SIZE
+        if (os.path.isfile(before_path) and
+                os.path.getsize(before_path) <= sync_size):
+            job.run()
         else:
-            shutil.copytree(before_path, after_path)
+            job.start()
+        return job
 
-        cmdpr.add_line(f'cpしました {before}→{after}')
+
+@edt.command.register
+def jobs(editor):
+    """バックグラウンドで実行した、cp2・mv2の進捗を表示する."""
+    if not fileops.jobs:
+        cmdpr.add_line('ジョブがありません')
+    for job in fileops.jobs:
+        cmdpr.add_line(job.progress_text())
 
 
 @edt.command.register
@@ -164,14 +229,18 @@ def check(editor, file_name=None):
         file_path = os.path.join(editor.current_dir, file_name)
         if not os.path.exists(file_path):
             cmdpr.add_line(f'ファイルが存在しません {file_path}')
+            return False
         else:
-            cmdpr.run_cmd(f'{sys.executable} -m flake8 {file_path}')
+            return editor.command.run_cmd(
+                f'{sys.executable} -m flake8 {file_path}')
 
     # 「check」file_nameがなければ、今開いているファイルをチェック
     elif not file_name and editor.opening_file:
-        cmdpr.run_cmd(f'{sys.executable} -m flake8 {editor.opening_file}')
+        return editor.command.run_cmd(
+            f'{sys.executable} -m flake8 {editor.opening_file}')
     else:
         cmdpr.add_line(f'ファイル名を指定するか、ファイルを開いてください')
+        return False
 
 
 @edt.command.register
@@ -195,23 +264,27 @@ def auto(editor, relative_path='.'):
     # 指定あるけど存在しないパス
     if not os.path.exists(path):
         cmdpr.add_line('存在しないパスです')
+        return False
 
     # パスがファイルで、pythonファイルなら実行
     elif os.path.isfile(path) and path.endswith('.py'):
         cmd = f'{sys.executable} -m pyformat -i {path}'
-        cmdpr.run_cmd(cmd)
+        return editor.command.run_cmd(cmd)
 
     # パスがファイルで、pythonファイルじゃない
     elif os.path.isfile(path):
         cmdpr.add_line('pythonファイルかディレクトリを選択して')
+        return False
 
     # パスがディレクトリなら、中のpythonファイルに実行
     elif os.path.isdir(path):
+        results = []
         for file_name in os.listdir(path):
             if file_name.endswith('.py'):
                 file_path = os.path.join(path, file_name)
                 cmd = f'{sys.executable} -m pyformat -i {file_path}'
-                cmdpr.run_cmd(cmd)
+                results.append(editor.command.run_cmd(cmd))
+        return False not in results
 
 
 @edt.command.register
@@ -273,7 +346,7 @@ def open_encoding(editor, encoding):
 @edt.command.register
 def venv(editor):
     """仮想環境の情報を表示する.(echo $VIRTUAL_ENV)."""
-    cmdpr.run_cmd(f'echo $VIRTUAL_ENV')
+    return editor.command.run_cmd(f'echo $VIRTUAL_ENV')
 
 
 @edt.command.register
@@ -303,3 +376,181 @@ def size2(editor, name):
     size = utils.get_dir_size(path)
     human_size = utils.change_bytes(size)
     cmdpr.add_line(f'{name}: {human_size} - {size}')
+
+
+@edt.command.register
+def stats(editor, action=None):
+    """処理時間・件数の統計を表示する.
+
+    stats: フェーズ毎の処理時間と件数の p50,p90,p99 を表示
+    stats on: 計測を有効にする
+    stats off: 計測を無効にする
+    stats clear: 記録した統計を削除する
+
+    """
+    if action == 'on':
+        editor.stats.enabled = True
+        cmdpr.add_line('計測を有効にしました')
+    elif action == 'off':
+        editor.stats.enabled = False
+        cmdpr.add_line('計測を無効にしました')
+    elif action == 'clear':
+        editor.stats.clear()
+        cmdpr.add_line('統計を削除しました')
+    elif action:
+        cmdpr.add_line(f'on, off, clear のどれかを指定してください {action}')
+    else:
+        lines = editor.stats.summary()
+        if not lines:
+            cmdpr.add_line('統計がありません。stats on で計測を有効にしてください')
+        for line in lines:
+            cmdpr.add_line(line)
+
+
+@edt.command.register
+def profile(editor, *args):
+    """コマンドをプロファイルしながら実行する.
+
+    profile check test.py: check test.py を実行し、処理時間の長い関数を表示
+
+    プロファイルは settings.EDITOR_PROFILE_DIR に保存されます。
+
+    """
+    if not args:
+        cmdpr.add_line('プロファイルするコマンドを指定してください')
+        return False
+    return profiling.profile(
+        args[0], editor.command.execute, ' '.join(args))
+
+
+@edt.command.register
+def dupes(editor, name='.'):
+    """同じ内容のファイルを探す.
+
+    dupes: カレントディレクトリ以下で探す
+    dupes path: path以下で探す
+
+    2回目以降は、変更のあったファイルだけハッシュを計算します。
+
+    """
+    path = os.path.join(editor.current_dir, name)
+    if not os.path.isdir(path):
+        cmdpr.add_line(f'ディレクトリがないです {path}')
+        return False
+
+    duplicates = find_duplicates(
+        path, settings.EDITOR_DUPES_CACHE, settings.EDITOR_DUPES_WORKERS)
+    wasted = 0
+    for size, paths in duplicates:
+        wasted += size * (len(paths) - 1)
+        cmdpr.add_line(f'{utils.change_bytes(size)} x {len(paths)}')
+        for file_path in paths:
+            cmdpr.add_line(f'    {file_path}')
+    cmdpr.add_line(
+        f'{len(duplicates)}グループ 削減できるサイズ: '
+        f'{utils.change_bytes(wasted)} - {wasted}')
+
+
+@edt.command.register
+def buffers(editor):
+    """開いているファイル(バッファ)の一覧を表示する.
+
+    *が付いているファイルは、保存されていない変更があります。
+
+    """
+    for buf in editor.buffers.tabs:
+        mark = ' *' if buf.dirty else ''
+        cmdpr.add_line(f'{buf.path}{mark}')
+
+
+def get_buffer_path(editor, file_name):
+    """close, revertで閉じるバッファのパスを返す."""
+    if file_name:
+        return os.path.join(editor.current_dir, file_name)
+    return editor.opening_file
+
+
+@edt.command.register
+def close(editor, file_name=None):
+    """ファイル(バッファ)を閉じる.
+
+    close: 開いているファイルを閉じる
+    close test.py: test.pyを閉じる
+
+    保存されていない変更がある場合は閉じません。
+    変更を捨てる場合は revert を使ってください。
+
+    """
+    path = get_buffer_path(editor, file_name)
+    if path not in editor.buffers:
+        cmdpr.add_line(f'開いていないファイルです {path}')
+    elif editor.buffers.remove(path):
+        cmdpr.add_line(f'閉じました {path}')
+    else:
+        cmdpr.add_line(f'保存されていない変更があります {path}')
+
+
+@edt.command.register
+def revert(editor, file_name=None):
+    """保存されていない変更を捨てて、ファイル(バッファ)を閉じる.
+
+    revert: 開いているファイルの変更を捨てる
+    revert test.py: test.pyの変更を捨てる
+
+    """
+    path = get_buffer_path(editor, file_name)
+    if editor.buffers.remove(path, force=True):
+        if path == editor.opening_file:
+            editor.load_code()
+        cmdpr.add_line(f'変更を捨てました {path}')
+    else:
+        cmdpr.add_line(f'開いていないファイルです {path}')
+
+
+@edt.command.register
+def revisions(editor, file_name=None):
+    """saveで保存した、ファイルのリビジョンの一覧を表示する.
+
+    revisions: 開いているファイルのリビジョン
+    revisions test.py: test.pyのリビジョン
+
+    """
+    path = get_buffer_path(editor, file_name)
+    file_revisions = editor.revisions.revisions(path)
+    if not file_revisions:
+        cmdpr.add_line(f'リビジョンがありません {path}')
+    for revision in file_revisions:
+        saved_at = datetime.fromtimestamp(revision['time'])
+        size = utils.change_bytes(revision['size'])
+        cmdpr.add_line(f'{revision["id"][:12]} {saved_at} {size}')
+
+
+@edt.command.register
+def restore(editor, revision_id, file_name=None):
+    """リビジョンの内容を、エディタに復元する.
+
+    restore 1a2b3c: 開いているファイルを、1a2b3cで始まるリビジョンに戻す
+    restore 1a2b3c test.py: test.pyを開いて、1a2b3cで始まるリビジョンに戻す
+
+    ファイルには保存されません。saveで保存してください。
+
+    """
+    path = get_buffer_path(editor, file_name)
+    revision = editor.revisions.find(path, revision_id)
+    if revision is None:
+        cmdpr.add_line(f'リビジョンが見当たらないです {revision_id} {path}')
+        return False
+
+    # 保存した時のエンコーディングでデコードする
+    encoding = revision.get('encoding', editor.open_encoding)
+    try:
+        code = editor.revisions.load(revision).decode(encoding)
+    except (UnicodeDecodeError, ValueError) as e:
+        cmdpr.add_line(f'復元できませんでした {revision["id"][:12]} {e}')
+        return False
+    if path != editor.opening_file:
+        editor.update_file(path)
+        editor.load_code()
+    editor.buffers.update(path, code)
+    editor.code = code
+    cmdpr.add_line(f'復元しました。saveで保存してください {revision["id"][:12]}')
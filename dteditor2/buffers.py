@@ -0,0 +1,157 @@
+"""開いたファイルの内容(バッファ)を保持するモジュール.
+
+一度開いたファイルは、パスと更新日時をキーにメモリへ保持し、
+ファイルを切り替えるたびにディスクから読み込み・デコードしなくてすむようにします。
+
+保存されていない変更があるバッファ(dirty)は、上限を超えても削除しません。
+
+"""
+from collections import OrderedDict
+import itertools
+import os
+
+
+class Buffer:
+    """開いているファイル1つ分の内容."""
+
+    def __init__(self, path, code, mtime, encoding, number):
+        """初期化.
+
+        引数:
+            path: ファイルのパス
+            code: デコードしたファイルの内容
+            mtime: 読み込んだ時の、ファイルの更新日時
+            encoding: デコードに使ったエンコーディング
+            number: 開いた順番。タブの並び順に使う
+
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        self.code = code
+        self.saved_code = code  # ファイルに保存されている内容
+        self.mtime = mtime
+        self.encoding = encoding
+        self.number = number
+
+    @property
+    def dirty(self):
+        """保存されていない変更があるかどうか."""
+        return self.code != self.saved_code
+
+    @property
+    def size(self):
+        """バッファが使っている、おおよその文字数."""
+        if self.code is self.saved_code:
+            return len(self.code)
+        return len(self.code) + len(self.saved_code)
+
+
+class BufferCache:
+    """バッファを、最近使った順に保持するLRUキャッシュ."""
+
+    def __init__(self, max_size):
+        """初期化.
+
+        引数:
+            max_size: 保持するバッファの合計文字数の上限
+
+        """
+        self.max_size = max_size
+        self.buffers = OrderedDict()
+        self.counter = itertools.count()
+
+    def __contains__(self, path):
+        return path in self.buffers
+
+    @property
+    def tabs(self):
+        """開いた順に並べたバッファのリスト."""
+        return sorted(self.buffers.values(), key=lambda buf: buf.number)
+
+    def get(self, path, encoding):
+        """キャッシュしているバッファを返す。読み込み直す必要があればNone.
+
+        dirtyなバッファは、ファイルが更新・削除されていてもそのまま返します。
+
+        """
+        buf = self.buffers.get(path)
+        if buf is None:
+            return None
+
+        if not buf.dirty:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                mtime = None
+            if mtime != buf.mtime or encoding != buf.encoding:
+                del self.buffers[path]
+                return None
+
+        self.buffers.move_to_end(path)
+        return buf
+
+    def add(self, path, code, mtime, encoding):
+        """ファイルから読み込んだ内容を、バッファとして追加する."""
+        old = self.buffers.get(path)
+        number = old.number if old else next(self.counter)
+        buf = Buffer(path, code, mtime, encoding, number)
+        self.buffers[path] = buf
+        self.buffers.move_to_end(path)
+        self.evict()
+        return buf
+
+    def update(self, path, code):
+        """エディタで変更された内容を、バッファへ反映する.
+
+        バッファがなければ何もせず、Falseを返します。
+        ブラウザから送られるコードは改行がCRLFになるので、
+        改行コードだけが違う場合は、変更のないバッファのままにします。
+
+        """
+        buf = self.buffers.get(path)
+        if buf is None:
+            return False
+        if (code != buf.saved_code and
+                code.replace('\r\n', '\n') ==
+                buf.saved_code.replace('\r\n', '\n')):
+            code = buf.saved_code
+        buf.code = code
+        self.buffers.move_to_end(path)
+        self.evict()
+        return True
+
+    def mark_saved(self, path, code, encoding):
+        """ファイルへ保存した内容を、変更のないバッファにする."""
+        buf = self.buffers.get(path)
+        if buf is None or buf.encoding != encoding:
+            buf = self.add(path, code, None, encoding)
+        buf.code = code
+        buf.saved_code = code
+        buf.mtime = os.path.getmtime(path)
+
+    def remove(self, path, force=False):
+        """バッファを閉じる。dirtyなら、forceがTrueの時だけ閉じる.
+
+        閉じられればTrueを返します。
+
+        """
+        buf = self.buffers.get(path)
+        if buf is None or (buf.dirty and not force):
+            return False
+        del self.buffers[path]
+        return True
+
+    def evict(self):
+        """上限を超えていれば、古いバッファから削除する.
+
+        dirtyなバッファと、最後に使ったバッファは削除しません。
+
+        """
+        total = sum(buf.size for buf in self.buffers.values())
+        for path in list(self.buffers)[:-1]:
+            if total <= self.max_size:
+                break
+            buf = self.buffers[path]
+            if not buf.dirty:
+                total -= buf.size
+                del self.buffers[path]
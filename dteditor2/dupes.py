@@ -0,0 +1,197 @@
+"""同じ内容のファイルを探すモジュール.
+
+dupesコマンドで利用されます。
+
+1. サイズでグループ分け
+2. サイズが同じファイル同士で、先頭と末尾だけのハッシュを比較
+3. それも同じファイル同士で、ファイル全体のハッシュを比較
+
+ハッシュの計算はスレッドプールで行い、大きなファイルはmmapで読み込みます。
+計算したハッシュは (パス, サイズ, 更新日時) をキーにファイルへ保存されるので、
+2回目以降は変更のあったファイルだけ計算します。
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import mmap
+import os
+from stat import S_ISREG
+
+# 部分ハッシュで読み込む、先頭と末尾のバイト数
+PARTIAL_SIZE = 64 * 1024
+
+# これ以上のサイズのファイルは、mmapで読み込む
+MMAP_SIZE = 16 * 1024 * 1024
+
+# mmapを使わない場合に、一度に読み込むバイト数
+BUFFER_SIZE = 1024 * 1024
+
+
+def partial_hash(path, size):
+    """ファイルの先頭と末尾のハッシュを返す."""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        digest.update(file.read(PARTIAL_SIZE))
+        if size > PARTIAL_SIZE * 2:
+            file.seek(-PARTIAL_SIZE, os.SEEK_END)
+        digest.update(file.read(PARTIAL_SIZE))
+    return digest.hexdigest()
+
+
+def full_hash(path, size):
+    """ファイル全体のハッシュを返す."""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        if size >= MMAP_SIZE:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+        else:
+            for chunk in iter(lambda: file.read(BUFFER_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """計算したハッシュを、ファイルに保存するクラス."""
+
+    def __init__(self, path):
+        """初期化。pathにあるキャッシュを読み込む."""
+        self.path = path
+        self.changed = False
+        try:
+            with open(path) as file:
+                self.data = json.load(file)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def get(self, path, stat, kind):
+        """キャッシュしたハッシュを返す。サイズか更新日時が違えばNone.
+
+        引数:
+            path: ファイルのパス
+            stat: os.stat_result
+            kind: 'partial' か 'full'
+
+        """
+        entry = self.data.get(path)
+        if entry and entry['size'] == stat.st_size and \
+                entry['mtime'] == stat.st_mtime_ns:
+            return entry.get(kind)
+        return None
+
+    def set(self, path, stat, kind, value):
+        """ハッシュをキャッシュする."""
+        entry = self.data.get(path)
+        if not entry or entry['size'] != stat.st_size or \
+                entry['mtime'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+            self.data[path] = entry
+        entry[kind] = value
+        self.changed = True
+
+    def prune(self, root, seen):
+        """rootの中で、今回見つからなかったファイルのキャッシュを削除."""
+        root = os.path.join(root, '')
+        for path in list(self.data):
+            if path.startswith(root) and path not in seen:
+                del self.data[path]
+                self.changed = True
+
+    def save(self):
+        """変更があれば、キャッシュをファイルへ保存する."""
+        if not self.changed:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.data, file)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+
+def group_by_hash(files, kind, func, cache, executor):
+    """(パス, stat)のリストを、サイズとハッシュ値毎のグループに分ける.
+
+    キャッシュにないハッシュだけを、スレッドプールで計算します。
+    2つ以上のファイルがあるグループだけを返します。
+
+    """
+    groups = {}
+    missing = []
+    for path, stat in files:
+        value = cache.get(path, stat, kind)
+        if value is None:
+            missing.append((path, stat))
+        else:
+            groups.setdefault((stat.st_size, value), []).append((path, stat))
+
+    def calculate(item):
+        path, stat = item
+        try:
+            return func(path, stat.st_size)
+        except (OSError, ValueError):
+            # 読み込めないファイルや、途中で空になった(mmapできない)ファイルは除く
+            return None
+
+    results = executor.map(calculate, missing)
+    for (path, stat), value in zip(missing, results):
+        if value is not None:
+            cache.set(path, stat, kind, value)
+            groups.setdefault((stat.st_size, value), []).append((path, stat))
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(root, cache_path, workers):
+    """root以下で、同じ内容のファイルのグループを探す.
+
+    引数:
+        root: 探すディレクトリ
+        cache_path: ハッシュのキャッシュファイルのパス
+        workers: ハッシュを計算するスレッド数
+
+    戻り値:
+        (サイズ, [パス, ...]) のリスト。無駄になっているサイズが大きい順
+
+    """
+    root = os.path.abspath(root)
+    sizes = {}
+    seen = set()
+    for dir_path, _, file_names in os.walk(root):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            try:
+                stat = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            # シンボリックリンクや空のファイル等は除く
+            if not S_ISREG(stat.st_mode) or not stat.st_size:
+                continue
+            seen.add(path)
+            sizes.setdefault(stat.st_size, []).append((path, stat))
+
+    candidates = [
+        item for files in sizes.values() if len(files) > 1 for item in files]
+
+    cache = HashCache(cache_path)
+    with ThreadPoolExecutor(workers) as executor:
+        groups = []
+        large_files = []
+        for group in group_by_hash(
+                candidates, 'partial', partial_hash, cache, executor):
+            # 部分ハッシュでファイル全体を読んでいれば、それで確定
+            if group[0][1].st_size <= PARTIAL_SIZE * 2:
+                groups.append(group)
+            else:
+                large_files.extend(group)
+        groups.extend(
+            group_by_hash(large_files, 'full', full_hash, cache, executor))
+
+    duplicates = [
+        (group[0][1].st_size, sorted(path for path, _ in group))
+        for group in groups
+    ]
+    cache.prune(root, seen)
+    cache.save()
+    duplicates.sort(
+        key=lambda item: item[0] * (len(item[1]) - 1), reverse=True)
+    return duplicates
@@ -0,0 +1,319 @@
+"""ファイル・ディレクトリのコピーを、バックグラウンドで行うモジュール.
+
+cp2, mv2(別のファイルシステムへの移動)で利用されます。
+
+・ファイル単位でスレッドプールを使い、並列にコピー
+・reflink(FICLONE)、copy_file_range、sendfile が使えれば、カーネル内でコピー
+・コピー中のファイルは「名前.part」に書き込み、中断後に再実行すると続きからコピー
+・コピー済みで、サイズと更新日時が同じファイルはスキップ
+・進捗とスループットを、定期的に出力エリアへ表示
+
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+import os
+import shutil
+import threading
+import time
+
+import cmdpr
+from django.conf import settings
+
+from .utils import change_bytes
+
+# Linuxの ioctl FICLONE。btrfsやxfs等で、データを共有したコピーを作る
+FICLONE = 0x40049409
+
+# 一度にコピーするバイト数。この単位で進捗を更新する
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# 実行したジョブのリスト。jobsコマンドで表示する
+jobs = []
+
+# ディレクトリのコピー中に、コピー先に置くファイル。中にコピー元のパスを書く
+UNFINISHED_MARKER = '.cp2-unfinished'
+
+
+def is_unfinished(src, dst):
+    """dstが、srcのコピーを途中で中断したディレクトリかどうか."""
+    marker = os.path.join(dst, UNFINISHED_MARKER)
+    try:
+        with open(marker, encoding='utf-8') as file:
+            return file.read() == os.path.abspath(src)
+    except OSError:
+        return False
+
+
+def raise_error(error):
+    """os.walkのonerrorに渡し、読めないディレクトリがあればエラーにする."""
+    raise error
+
+
+def reflink(src_fd, dst_fd):
+    """reflinkでコピーする。できなければFalseを返す."""
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+def copy_range(src_fd, dst_fd, offset, size, progress):
+    """src_fdのoffsetからsizeまでを、dst_fdへコピーする.
+
+    copy_file_range、sendfile、read/writeの順で、使えるものを利用します。
+    progressには、コピーしたバイト数が渡されます。
+
+    """
+    offset = _copy_file_range(src_fd, dst_fd, offset, size, progress)
+    if offset < size:
+        offset = _sendfile(src_fd, dst_fd, offset, size, progress)
+
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while offset < size:
+        data = os.read(src_fd, CHUNK_SIZE)
+        if not data:
+            break
+        os.write(dst_fd, data)
+        offset += len(data)
+        progress(len(data))
+
+
+def _copy_file_range(src_fd, dst_fd, offset, size, progress):
+    """os.copy_file_rangeでコピーし、コピーできた位置を返す.
+
+    最初の呼び出しで失敗すれば、対応していないとみなし何もしません。
+
+    """
+    if not hasattr(os, 'copy_file_range'):
+        return offset
+    start = offset
+    while offset < size:
+        count = min(CHUNK_SIZE, size - offset)
+        try:
+            copied = os.copy_file_range(
+                src_fd, dst_fd, count, offset_src=offset, offset_dst=offset)
+        except OSError:
+            if offset == start:
+                return offset
+            raise
+        if not copied:
+            break
+        offset += copied
+        progress(copied)
+    return offset
+
+
+def _sendfile(src_fd, dst_fd, offset, size, progress):
+    """os.sendfileでコピーし、コピーできた位置を返す.
+
+    最初の呼び出しで失敗すれば、対応していないとみなし何もしません。
+
+    """
+    if not hasattr(os, 'sendfile'):
+        return offset
+    start = offset
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while offset < size:
+        count = min(CHUNK_SIZE, size - offset)
+        try:
+            copied = os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError:
+            if offset == start:
+                return offset
+            raise
+        if not copied:
+            break
+        offset += copied
+        progress(copied)
+    return offset
+
+
+class CopyJob:
+    """バックグラウンドで行う、コピー・移動のジョブ."""
+
+    def __init__(self, src, dst, move=False):
+        """初期化.
+
+        引数:
+            src: コピー元のパス
+            dst: コピー先のパス
+            move: Trueなら、コピー後にコピー元を削除する
+
+        """
+        self.src = src
+        self.dst = dst
+        self.move = move
+        self.name = 'mv2' if move else 'cp2'
+        self.status = 'waiting'
+        self.total_files = 0
+        self.total_bytes = 0
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.start_time = None
+        self.end_time = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """別スレッドでジョブを開始し、ジョブ自身を返す."""
+        jobs.append(self)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def join(self):
+        """ジョブの終了を待ち、成功したかどうかを返す."""
+        if self.thread is not None:
+            self.thread.join()
+        return self.status == 'done'
+
+    def run(self):
+        """コピーを行う。別スレッドで呼ばれる."""
+        self.status = 'running'
+        self.start_time = time.time()
+        try:
+            tasks = self.plan()
+            self.total_files = len(tasks)
+            self.total_bytes = sum(size for _, _, size in tasks)
+            cmdpr.add_line(
+                f'{self.name}を開始しました {self.src}→{self.dst} '
+                f'{self.total_files}ファイル {change_bytes(self.total_bytes)}')
+            self.copy_all(tasks)
+            if self.copied_files != self.total_files:
+                raise OSError(
+                    f'コピーできなかったファイルがあります '
+                    f'{self.copied_files}/{self.total_files}')
+            if os.path.isdir(self.src) and not os.path.islink(self.src):
+                os.remove(os.path.join(self.dst, UNFINISHED_MARKER))
+            shutil.copystat(self.src, self.dst, follow_symlinks=False)
+            if self.move:
+                if os.path.isdir(self.src) and not os.path.islink(self.src):
+                    shutil.rmtree(self.src)
+                else:
+                    os.remove(self.src)
+        except Exception as e:
+            self.status = 'error'
+            cmdpr.add_line(f'{self.name}に失敗しました {self.src} {e}')
+        else:
+            self.status = 'done'
+            cmdpr.add_line(f'{self.name}しました {self.src}→{self.dst}')
+        finally:
+            self.end_time = time.time()
+            cmdpr.add_line(self.progress_text())
+
+    def plan(self):
+        """(コピー元, コピー先, サイズ)のリストを作り、ディレクトリを作成する."""
+        if os.path.islink(self.src):
+            if not os.path.lexists(self.dst):
+                os.symlink(os.readlink(self.src), self.dst)
+            return []
+        if not os.path.isdir(self.src):
+            return [(self.src, self.dst, os.path.getsize(self.src))]
+
+        # 中断した場合に、再実行で続きからコピーできるように印を付ける
+        os.makedirs(self.dst, exist_ok=True)
+        marker = os.path.join(self.dst, UNFINISHED_MARKER)
+        with open(marker, 'w', encoding='utf-8') as file:
+            file.write(os.path.abspath(self.src))
+
+        tasks = []
+        for root, dirs, files in os.walk(self.src, onerror=raise_error):
+            dst_root = os.path.join(
+                self.dst, os.path.relpath(root, self.src))
+            os.makedirs(dst_root, exist_ok=True)
+            for name in dirs + files:
+                src_path = os.path.join(root, name)
+                dst_path = os.path.join(dst_root, name)
+                if os.path.islink(src_path):
+                    if not os.path.lexists(dst_path):
+                        os.symlink(os.readlink(src_path), dst_path)
+                elif name in files:
+                    tasks.append(
+                        (src_path, dst_path, os.path.getsize(src_path)))
+        return tasks
+
+    def copy_all(self, tasks):
+        """スレッドプールでファイルをコピーし、定期的に進捗を表示する."""
+        interval = settings.EDITOR_COPY_REPORT_INTERVAL
+        with ThreadPoolExecutor(settings.EDITOR_COPY_WORKERS) as executor:
+            futures = {
+                executor.submit(self.copy_file, *task) for task in tasks}
+            while futures:
+                done, futures = wait(
+                    futures, timeout=interval, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()  # 例外があれば、ここで送出
+                if futures:
+                    cmdpr.add_line(self.progress_text())
+
+        # ディレクトリの更新日時等は、中のファイルを作り終えてから
+        if os.path.isdir(self.src):
+            for root, dirs, _ in os.walk(self.src, onerror=raise_error):
+                for name in dirs:
+                    src_path = os.path.join(root, name)
+                    dst_path = os.path.join(
+                        self.dst, os.path.relpath(src_path, self.src))
+                    shutil.copystat(src_path, dst_path, follow_symlinks=False)
+
+    def copy_file(self, src, dst, size):
+        """1ファイルのコピー。スレッドプールから呼ばれる."""
+        src_stat = os.stat(src)
+
+        # サイズと更新日時が同じなら、前回コピー済み
+        if os.path.exists(dst):
+            dst_stat = os.stat(dst)
+            if (dst_stat.st_size == size and
+                    int(dst_stat.st_mtime) == int(src_stat.st_mtime)):
+                self.add_progress(size, files=1)
+                return
+
+        # 前回中断した.partファイルがあれば、その続きから
+        part = dst + '.part'
+        offset = 0
+        if os.path.exists(part):
+            part_stat = os.stat(part)
+            if (part_stat.st_mtime >= src_stat.st_mtime and
+                    part_stat.st_size <= size):
+                offset = part_stat.st_size
+
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            dst_fd = os.open(part, os.O_WRONLY | os.O_CREAT, 0o666)
+            try:
+                os.ftruncate(dst_fd, offset)
+                self.add_progress(offset)
+                if offset == 0 and size and reflink(src_fd, dst_fd):
+                    self.add_progress(size)
+                else:
+                    copy_range(src_fd, dst_fd, offset, size, self.add_progress)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+
+        shutil.copystat(src, part)
+        os.replace(part, dst)
+        self.add_progress(0, files=1)
+
+    def add_progress(self, size, files=0):
+        """コピーしたバイト数、ファイル数を加算する."""
+        with self.lock:
+            self.copied_bytes += size
+            self.copied_files += files
+
+    def progress_text(self):
+        """進捗とスループットを表す文字列を返す."""
+        end_time = self.end_time or time.time()
+        elapsed = max(end_time - (self.start_time or end_time), 0.001)
+        percent = (
+            self.copied_bytes / self.total_bytes * 100
+            if self.total_bytes else 100)
+        return (
+            f'{self.name} {self.status} {self.src}→{self.dst} '
+            f'{self.copied_files}/{self.total_files}ファイル '
+            f'{change_bytes(self.copied_bytes)}/'
+            f'{change_bytes(self.total_bytes)} ({percent:.1f}%) '
+            f'{change_bytes(self.copied_bytes / elapsed)}/s'
+        )
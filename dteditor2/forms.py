@@ -16,3 +16,9 @@ class EditorForm(forms.Form):
             'autocomplete': 'off',
         })
     )
+
+    # スクリプト入力欄。改行・;・&&で区切った複数のコマンド
+    script = forms.CharField(
+        required=False,
+        widget=forms.Textarea,
+    )
@@ -0,0 +1,138 @@
+"""コマンド履歴を管理するモジュール.
+
+コマンド履歴はファイルへ1行1コマンド(JSON文字列)で追記され、再起動後も残ります。
+同じコマンドは1つにまとめられ、最大件数を超えると古いものから削除されます。
+
+前方一致検索のため、コマンドをソートしたリストも持っています。
+
+"""
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import heapq
+import itertools
+import json
+import os
+import threading
+
+
+class CommandHistory:
+    """ファイルに保存される、コマンド履歴."""
+
+    def __init__(self, path, max_size):
+        """初期化。pathに保存されている履歴を読み込む.
+
+        引数:
+            path: 履歴を保存するファイルのパス
+            max_size: 保持するコマンドの最大件数
+
+        """
+        self.path = path
+        self.max_size = max_size
+        self.entries = OrderedDict()  # コマンド: 実行した順番。古い順
+        self.index = []  # ソートしたコマンドのリスト
+        self.counter = itertools.count()
+        self.file_lines = 0  # ファイルの行数
+        self.lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """古い順にコマンドを返す."""
+        with self.lock:
+            return iter(list(self.entries))
+
+    def load(self):
+        """ファイルから履歴を読み込む."""
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                for line in file:
+                    self.file_lines += 1
+                    try:
+                        self._add(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            return
+        if self.file_lines > len(self.entries) * 2:
+            self.compact()
+
+    def add(self, cmd):
+        """コマンドを履歴に追加し、ファイルへ追記する."""
+        with self.lock:
+            if self.entries and next(reversed(self.entries)) == cmd:
+                return
+            self._add(cmd)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(cmd) + '\n')
+            self.file_lines += 1
+
+            # 重複や削除したコマンドで、ファイルが大きくなりすぎたら書き直す
+            if self.file_lines > self.max_size * 2:
+                self.compact()
+
+    def _add(self, cmd):
+        """メモリ上の履歴にコマンドを追加する."""
+        if cmd in self.entries:
+            self.entries.move_to_end(cmd)
+        else:
+            insort(self.index, cmd)
+        self.entries[cmd] = next(self.counter)
+
+        while len(self.entries) > self.max_size:
+            old, _ = self.entries.popitem(last=False)
+            del self.index[bisect_left(self.index, old)]
+
+    def compact(self):
+        """今の履歴だけで、ファイルを書き直す."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            for cmd in self.entries:
+                file.write(json.dumps(cmd) + '\n')
+        os.replace(temp_path, self.path)
+        self.file_lines = len(self.entries)
+
+    def clear(self):
+        """履歴を全て削除する."""
+        with self.lock:
+            self.entries.clear()
+            del self.index[:]
+            self.compact()
+
+    def search(self, query='', mode='prefix', limit=50):
+        """履歴を検索し、新しい順にlimit件のコマンドを返す.
+
+        引数:
+            query: 検索する文字列
+            mode: 'prefix'なら前方一致。'fuzzy'なら、queryの文字が順番に含まれる
+            limit: 最大件数
+
+        コマンドの実行と同時に呼ばれるので、検索中は履歴の追加を待たせます。
+
+        """
+        with self.lock:
+            return self._search(query, mode, limit)
+
+    def _search(self, query, mode, limit):
+        """ロックを取得した状態で、履歴を検索する."""
+        if not query:
+            return list(itertools.islice(reversed(self.entries), limit))
+
+        if mode == 'fuzzy':
+            return list(itertools.islice(
+                (cmd for cmd in reversed(self.entries)
+                 if self.is_fuzzy_match(query, cmd)),
+                limit))
+
+        # ソートしたリストの中で、queryで始まるコマンドは連続している
+        start = bisect_left(self.index, query)
+        end = bisect_left(self.index, query + '\U0010ffff', lo=start)
+        return heapq.nlargest(
+            limit, self.index[start:end], key=self.entries.get)
+
+    @staticmethod
+    def is_fuzzy_match(query, cmd):
+        """queryの文字が、cmdに順番通りに含まれているかどうか."""
+        chars = iter(cmd)
+        return all(char in chars for char in query)
@@ -0,0 +1,249 @@
+"""エディタの重い処理のベンチマークを行うコマンド.
+
+一時ディレクトリに、大量のファイルがあるディレクトリ、深い階層のディレクトリ、
+大きなファイルを作成し、各処理の時間を計測します。
+結果はJSONで出力されるので、コミット間で比較することができます。
+
+python manage.py bench --output before.json
+python manage.py bench --compare before.json
+
+"""
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from dteditor2 import utils
+from dteditor2.utils import editor
+from dteditor2.views import ImgView
+
+# PNGのシグネチャ。ImgViewは中身を検証しないので、後ろはダミーのバイト列
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def measure(func, repeat):
+    """funcをrepeat回実行し、処理時間(ミリ秒)の統計を返す."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        'repeat': repeat,
+        'min': min(durations),
+        'median': statistics.median(durations),
+        'mean': statistics.mean(durations),
+        'max': max(durations),
+    }
+
+
+def get_commit():
+    """現在のgitのコミットハッシュを返す。取得できなければ空文字."""
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return output.decode().strip()
+
+
+class Command(BaseCommand):
+    """ベンチマークを実行するコマンド."""
+
+    help = 'エディタの重い処理のベンチマークを行い、結果をJSONで出力する'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--flat-files', type=int, default=100000,
+            help='1つのディレクトリに作成するファイル数')
+        parser.add_argument(
+            '--depth', type=int, default=50,
+            help='深い階層のディレクトリの深さ')
+        parser.add_argument(
+            '--files-per-level', type=int, default=20,
+            help='深い階層のディレクトリの、各階層のファイル数')
+        parser.add_argument(
+            '--big-file-mb', type=int, default=20,
+            help='大きなファイルのサイズ(MB)')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='各ベンチマークの実行回数')
+        parser.add_argument(
+            '--output', help='結果を書き込むJSONファイル。省略時は標準出力')
+        parser.add_argument(
+            '--compare', help='比較対象の、以前の結果のJSONファイル')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='中央値がこの割合以上遅くなれば、劣化とみなす')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp(prefix='dteditor2-bench-')
+        try:
+            self.stderr.write(f'ファイルを作成しています {root}')
+            paths = self.create_trees(root, options)
+            benchmarks = self.run_benchmarks(paths, options['repeat'])
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        result = {
+            'commit': get_commit(),
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'options': {
+                key: options[key] for key in (
+                    'flat_files', 'depth', 'files_per_level',
+                    'big_file_mb', 'repeat')
+            },
+            'benchmarks': benchmarks,
+        }
+        text = json.dumps(result, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(text)
+        else:
+            self.stdout.write(text)
+
+        if options['compare']:
+            self.compare(options['compare'], benchmarks, options['threshold'])
+
+    def create_trees(self, root, options):
+        """ベンチマーク用のディレクトリ・ファイルを作成する."""
+        flat_dir = os.path.join(root, 'flat')
+        os.mkdir(flat_dir)
+        for i in range(options['flat_files']):
+            with open(os.path.join(flat_dir, f'file{i}.txt'), 'wb') as file:
+                file.write(b'x')
+
+        deep_dir = os.path.join(root, 'deep')
+        path = deep_dir
+        for level in range(options['depth']):
+            path = os.path.join(path, f'level{level}')
+            os.makedirs(path)
+            for i in range(options['files_per_level']):
+                file_path = os.path.join(path, f'file{i}.txt')
+                with open(file_path, 'wb') as file:
+                    file.write(b'x' * 1024)
+
+        big_file = os.path.join(root, 'big.py')
+        line = b'print("django-torina-editor2")\n'
+        count = options['big_file_mb'] * 1024 * 1024 // len(line)
+        with open(big_file, 'wb') as file:
+            file.write(line * count)
+
+        img_file = os.path.join(root, 'img.png')
+        with open(img_file, 'wb') as file:
+            file.write(PNG_SIGNATURE + os.urandom(1024 * 1024))
+
+        return {
+            'flat_dir': flat_dir,
+            'deep_dir': deep_dir,
+            'big_file': big_file,
+            'img_file': img_file,
+        }
+
+    def run_benchmarks(self, paths, repeat):
+        """各ベンチマークを実行し、名前: 結果 の辞書を返す."""
+        factory = RequestFactory()
+        saved = {
+            name: getattr(editor, name)
+            for name in (
+                'request', 'current_dir', 'opening_file', 'file_name',
+                'file_extension', 'file_type', 'code')
+        }
+        benchmarks = {}
+
+        # テストクライアントでアクセスするため、テスト環境を用意する
+        # manage.py test から呼ばれた時は、既に用意されている
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            test_environment = False
+        else:
+            test_environment = True
+
+        try:
+            editor.request = factory.get('/')
+            editor.current_dir = paths['flat_dir']
+
+            def tree_update():
+                editor.tree.update()
+                editor.tree.create()
+            benchmarks['tree_update_flat'] = measure(tree_update, repeat)
+
+            benchmarks['get_dir_size_deep'] = measure(
+                lambda: utils.get_dir_size(paths['deep_dir']), repeat)
+
+            editor.opening_file = paths['big_file']
+
+            def update_code_cold():
+                editor.buffers.remove(paths['big_file'], force=True)
+                editor.update_code()
+            benchmarks['update_code_big'] = measure(update_code_cold, repeat)
+            benchmarks['update_code_big_cached'] = measure(
+                editor.update_code, repeat)
+
+            img_view = ImgView.as_view()
+
+            def get_img():
+                request = factory.get('/')
+                img_view(request, path=paths['img_file']).render()
+            benchmarks['img_view'] = measure(get_img, repeat)
+
+            client = Client()
+            url = reverse('dteditor2:home')
+
+            def get_home():
+                client.get(url, {
+                    'current_dir': paths['flat_dir'],
+                    'opening_file': paths['big_file'],
+                })
+
+            # 画面のキャッシュを使わない場合。以前の結果と比較できるように同じ名前
+            def get_home_cold():
+                cache.clear()
+                get_home()
+            benchmarks['home_round_trip'] = measure(get_home_cold, repeat)
+            benchmarks['home_round_trip_warm'] = measure(get_home, repeat)
+        finally:
+            if test_environment:
+                teardown_test_environment()
+            editor.buffers.remove(paths['big_file'], force=True)
+            for name, value in saved.items():
+                setattr(editor, name, value)
+        return benchmarks
+
+    def compare(self, path, benchmarks, threshold):
+        """以前の結果と中央値を比較し、劣化していればエラーにする."""
+        with open(path) as file:
+            before = json.load(file)['benchmarks']
+
+        regressions = []
+        for name, result in sorted(benchmarks.items()):
+            if name not in before:
+                continue
+            old = before[name]['median']
+            new = result['median']
+            ratio = (new - old) / old if old else 0
+            self.stderr.write(
+                f'{name}: {old:.2f}ms -> {new:.2f}ms ({ratio:+.1%})')
+            if ratio > threshold:
+                regressions.append(name)
+
+        if regressions:
+            raise CommandError(f'劣化しました {", ".join(regressions)}')
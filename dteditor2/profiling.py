@@ -0,0 +1,92 @@
+"""cProfileでプロファイルを取るモジュール.
+
+profileコマンドや、?profile=1 付きのアクセス、settings.EDITOR_PROFILE で利用されます。
+プロファイルは settings.EDITOR_PROFILE_DIR に保存され、
+処理時間の長い関数の上位が出力エリアに表示されます。
+
+保存したプロファイルは、以下のように詳しく見ることができます
+python -m pstats profiles/request-20170101-000000-000000.prof
+
+"""
+import cProfile
+from datetime import datetime
+import glob
+import os
+import pstats
+import re
+import threading
+
+import cmdpr
+from django.conf import settings
+
+# プロファイル中はロックしておく。プロファイラは同時に1つしか動かせない
+lock = threading.Lock()
+
+
+def is_enabled(request):
+    """このリクエストでプロファイルを取るかどうか."""
+    return settings.EDITOR_PROFILE or request.GET.get('profile') == '1'
+
+
+def save(profiler, name):
+    """プロファイルをファイルに保存し、そのパスを返す."""
+    os.makedirs(settings.EDITOR_PROFILE_DIR, exist_ok=True)
+    name = re.sub(r'[^\w.-]', '_', name)
+    file_name = f'{name}-{datetime.now():%Y%m%d-%H%M%S-%f}.prof'
+    path = os.path.join(settings.EDITOR_PROFILE_DIR, file_name)
+    profiler.dump_stats(path)
+    remove_old()
+    return path
+
+
+def remove_old():
+    """保存したプロファイルが多すぎれば、古いものから削除する."""
+    paths = sorted(
+        glob.glob(os.path.join(settings.EDITOR_PROFILE_DIR, '*.prof')),
+        key=os.path.getmtime)
+    for path in paths[:-settings.EDITOR_PROFILE_KEEP or None]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+
+
+def get_top_lines(profiler, top):
+    """関数自体の処理時間(tottime)が長い順に、top件の文字列を返す."""
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+    lines = ['tottime(ms) cumtime(ms) ncalls function']
+    for (file_name, lineno, func_name), row in rows[:top]:
+        _, ncalls, tottime, cumtime, _ = row
+        lines.append(
+            f'{tottime * 1000:11.2f} {cumtime * 1000:11.2f} {ncalls:6} '
+            f'{func_name} {file_name}:{lineno}'
+        )
+    return lines
+
+
+def profile(name, func, *args, **kwargs):
+    """funcをプロファイルしながら実行し、funcの戻り値を返す.
+
+    プロファイルはファイルに保存し、上位の関数を出力エリアに表示します。
+    既にプロファイル中(?profile=1 のアクセスの中のprofileコマンド等)なら、
+    プロファイルせずにfuncを実行します。
+
+    引数:
+        name: プロファイルのファイル名に使う名前
+        func: プロファイルする関数
+
+    """
+    if not lock.acquire(blocking=False):
+        cmdpr.add_line(f'プロファイル中のため、そのまま実行します {name}')
+        return func(*args, **kwargs)
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        lock.release()
+        path = save(profiler, name)
+        cmdpr.add_line(f'プロファイルを保存しました {path}')
+        for line in get_top_lines(profiler, settings.EDITOR_PROFILE_TOP):
+            cmdpr.add_line(line)
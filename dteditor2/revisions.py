@@ -0,0 +1,214 @@
+"""保存したファイルの履歴(リビジョン)を管理するモジュール.
+
+saveコマンドで保存するたびに、ファイルの内容をリビジョンとして記録します。
+revisions、restoreコマンドで一覧の表示・復元ができます。
+
+ファイルの内容は、行の区切りで内容に応じたチャンクに分割され、
+チャンクのハッシュをファイル名にして、zlibで圧縮して保存されます。
+前のリビジョンと同じチャンクは保存済みなので、変更した部分のチャンクだけが増えます。
+
+古いリビジョンと、どのリビジョンからも使われていないチャンクの削除は、
+保存とは別のスレッドで行います。
+
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+# チャンクの最小・最大サイズ。この間で、行の内容に応じて区切る
+MIN_CHUNK_SIZE = 4 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+
+# 行のcrc32とこのマスクの論理積が0なら、その行でチャンクを区切る
+CHUNK_MASK = 0x3f
+
+
+def split_chunks(data):
+    """dataを、内容に応じたチャンクのリストに分割する.
+
+    区切る位置が行の内容で決まるので、一部を変更しても他のチャンクは変わりません。
+
+    """
+    chunks = []
+    start = 0
+    position = 0
+    for line in data.splitlines(keepends=True):
+        position += len(line)
+        size = position - start
+        if size >= MAX_CHUNK_SIZE or (
+                size >= MIN_CHUNK_SIZE and
+                not zlib.crc32(line) & CHUNK_MASK):
+            chunks.append(data[start:position])
+            start = position
+    if start < len(data):
+        chunks.append(data[start:])
+    return chunks
+
+
+class RevisionStore:
+    """リビジョンを、ディレクトリへ保存するクラス.
+
+    root/objects/ab/cdef...  zlibで圧縮したチャンク
+    root/files/ハッシュ.jsonl  ファイル毎のリビジョンの一覧。1行1リビジョン
+
+    """
+
+    def __init__(self, root, keep, gc_interval):
+        """初期化.
+
+        引数:
+            root: 保存するディレクトリ
+            keep: ファイル毎に残すリビジョンの数
+            gc_interval: 古いリビジョンを削除する間隔(秒)
+
+        """
+        self.root = root
+        self.keep = keep
+        self.gc_interval = gc_interval
+        self.last_gc = 0
+        self.lock = threading.Lock()  # 記録と、チャンクの削除を排他する
+        self.gc_lock = threading.Lock()
+
+    def get_log_path(self, path):
+        """ファイルのリビジョン一覧のパスを返す."""
+        name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.root, 'files', f'{name}.jsonl')
+
+    def get_object_path(self, digest):
+        """チャンクの保存先のパスを返す."""
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def revisions(self, path):
+        """ファイルのリビジョンのリストを、新しい順に返す."""
+        try:
+            with open(self.get_log_path(path), encoding='utf-8') as file:
+                revisions = [json.loads(line) for line in file if line.strip()]
+        except FileNotFoundError:
+            return []
+        revisions.reverse()
+        return revisions
+
+    def record(self, path, data, encoding):
+        """ファイルの内容を、新しいリビジョンとして記録する.
+
+        前のリビジョンと同じ内容なら記録せず、Noneを返します。
+
+        引数:
+            path: 保存したファイルのパス
+            data: 保存したバイト列
+            encoding: 保存に使ったエンコーディング。復元する時のデコードに使う
+
+        """
+        revision_id = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            revisions = self.revisions(path)
+            if revisions and revisions[0]['id'] == revision_id:
+                return None
+
+            chunks = []
+            for chunk in split_chunks(data):
+                digest = hashlib.sha256(chunk).hexdigest()
+                self.write_object(digest, chunk)
+                chunks.append(digest)
+
+            revision = {
+                'id': revision_id,
+                'path': os.path.abspath(path),
+                'time': time.time(),
+                'size': len(data),
+                'encoding': encoding,
+                'chunks': chunks,
+            }
+            log_path = self.get_log_path(path)
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            with open(log_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(revision) + '\n')
+        return revision
+
+    def write_object(self, digest, chunk):
+        """チャンクを保存する。保存済みなら、更新日時だけ新しくする.
+
+        更新日時は、削除処理中に使われたチャンクを消さないために使います。
+
+        """
+        object_path = self.get_object_path(digest)
+        if os.path.exists(object_path):
+            os.utime(object_path)
+            return
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = f'{object_path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(zlib.compress(chunk))
+        os.replace(temp_path, object_path)
+
+    def find(self, path, revision_id):
+        """revision_idで始まるリビジョンを返す。なければNone."""
+        for revision in self.revisions(path):
+            if revision['id'].startswith(revision_id):
+                return revision
+        return None
+
+    def load(self, revision):
+        """リビジョンの内容を返す."""
+        chunks = []
+        for digest in revision['chunks']:
+            with open(self.get_object_path(digest), 'rb') as file:
+                chunks.append(zlib.decompress(file.read()))
+        data = b''.join(chunks)
+        if hashlib.sha256(data).hexdigest() != revision['id']:
+            raise ValueError(f'リビジョンが壊れています {revision["id"]}')
+        return data
+
+    def schedule_gc(self):
+        """前回からgc_interval秒たっていれば、別スレッドでgcを行う."""
+        if time.time() - self.last_gc < self.gc_interval:
+            return
+        if not self.gc_lock.acquire(blocking=False):
+            return  # 実行中
+        self.last_gc = time.time()
+        thread = threading.Thread(target=self._run_gc, daemon=True)
+        thread.start()
+
+    def _run_gc(self):
+        try:
+            self.gc()
+        finally:
+            self.gc_lock.release()
+
+    def gc(self):
+        """古いリビジョンと、使われていないチャンクを削除する."""
+        start = time.time()
+        used = set()
+        for log_path in glob.glob(os.path.join(self.root, 'files', '*.jsonl')):
+            with self.lock:
+                with open(log_path, encoding='utf-8') as file:
+                    lines = [line for line in file if line.strip()]
+                if len(lines) > self.keep:
+                    lines = lines[-self.keep:]
+                    temp_path = log_path + '.tmp'
+                    with open(temp_path, 'w', encoding='utf-8') as file:
+                        file.writelines(lines)
+                    os.replace(temp_path, log_path)
+            for line in lines:
+                used.update(json.loads(line)['chunks'])
+
+        objects_dir = os.path.join(self.root, 'objects')
+        unused = [
+            object_path
+            for object_path in glob.glob(os.path.join(objects_dir, '*', '*'))
+            if os.path.basename(os.path.dirname(object_path)) +
+            os.path.basename(object_path) not in used
+        ]
+
+        # gcを始めた後に記録・再利用されたチャンクは、更新日時が新しいので残す
+        with self.lock:
+            for object_path in unused:
+                try:
+                    if os.path.getmtime(object_path) < start:
+                        os.remove(object_path)
+                except FileNotFoundError:
+                    continue
@@ -0,0 +1,137 @@
+"""エディタの処理時間・件数を計測するモジュール.
+
+settings.EDITOR_STATS が True の時だけ計測を行います。
+無効時は、何もしないコンテキストマネージャを返すだけなので、ほぼコストはかかりません。
+
+"""
+from collections import deque
+import math
+import time
+
+from django.conf import settings
+
+
+def percentile(values, percent):
+    """valuesのパーセンタイル値を返す(nearest-rank法).
+
+    引数:
+        values: 数値のリスト
+        percent: 0〜100のパーセント
+
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    # 小さい方から数えて、全体のpercent%以上になる最初の値
+    index = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[index]
+
+
+class NullPhase:
+    """計測が無効な時に使う、何もしないコンテキストマネージャ."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase:
+    """with文の中の処理時間を計測するコンテキストマネージャ."""
+
+    def __init__(self, stats, name):
+        """初期化."""
+        self.stats = stats
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        duration = (time.perf_counter() - self.start) * 1000
+        self.stats.add_timing(self.name, duration)
+        return False
+
+
+class Stats:
+    """リクエスト毎の処理時間(ミリ秒)と件数を記録するクラス."""
+
+    def __init__(self):
+        """初期化."""
+        self.enabled = settings.EDITOR_STATS
+        self.window = settings.EDITOR_STATS_WINDOW
+        self.timings = []  # 今回のリクエストの(フェーズ名, ミリ秒)
+        self.counts = {}  # 今回のリクエストの件数
+        self.timing_samples = {}  # フェーズ名: 直近の処理時間
+        self.count_samples = {}  # カウンタ名: 直近の件数
+
+    def begin(self):
+        """リクエストの計測を開始する."""
+        if self.enabled:
+            self.timings = []
+            self.counts = {}
+
+    def end(self):
+        """リクエストの計測を終了し、件数を履歴へ追加する."""
+        if self.enabled:
+            for name, value in self.counts.items():
+                self._sample(self.count_samples, name, value)
+
+    def phase(self, name):
+        """with文で使う。処理時間をnameとして記録する."""
+        if self.enabled:
+            return Phase(self, name)
+        return NULL_PHASE
+
+    def add_timing(self, name, duration):
+        """処理時間を記録する."""
+        self.timings.append((name, duration))
+        self._sample(self.timing_samples, name, duration)
+
+    def count(self, name, value=1):
+        """件数を加算する."""
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def _sample(self, samples, name, value):
+        """直近window件だけを保持する履歴へ追加する."""
+        if name not in samples:
+            samples[name] = deque(maxlen=self.window)
+        samples[name].append(value)
+
+    def clear(self):
+        """記録した履歴を削除する."""
+        self.timings = []
+        self.counts = {}
+        self.timing_samples.clear()
+        self.count_samples.clear()
+
+    def server_timing(self):
+        """Server-Timingヘッダの値を返す."""
+        metrics = [
+            f'{name};dur={duration:.2f}' for name, duration in self.timings]
+        metrics.extend(
+            f'{name};desc="{value}"' for name, value in self.counts.items())
+        return ', '.join(metrics)
+
+    def summary(self):
+        """フェーズ・カウンタ毎のp50,p90,p99を表す文字列のリストを返す."""
+        lines = []
+        for title, samples, unit in (
+                ('timing', self.timing_samples, 'ms'),
+                ('count', self.count_samples, '')):
+            for name, values in samples.items():
+                values = list(values)
+                lines.append(
+                    f'{title} {name}: n={len(values)} '
+                    f'p50={percentile(values, 50):.2f}{unit} '
+                    f'p90={percentile(values, 90):.2f}{unit} '
+                    f'p99={percentile(values, 99):.2f}{unit}'
+                )
+        return lines
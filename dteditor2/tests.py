@@ -1,7 +1,30 @@
 """テストを行うモジュール."""
-from django.test import TestCase
+import hashlib
+import inspect
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from unittest import mock, skipIf
+
+import cmdpr
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
 from django.urls import reverse
 
+from dteditor2 import base_command, fileops, profiling, views
+from dteditor2.buffers import BufferCache
+from dteditor2.dupes import find_duplicates
+from dteditor2.history import CommandHistory
+from dteditor2.revisions import RevisionStore
+from dteditor2.stats import percentile
+from dteditor2.utils import editor, parse_script
+
 
 class TestViews(TestCase):
     """Viewのテストクラス."""
@@ -18,3 +41,588 @@ class TestViews(TestCase):
             reverse('dteditor2:img', kwargs={'path': '1.png'})
         )
         self.assertEqual(response.status_code, 404)
+
+
+class TestStats(TestCase):
+    """処理時間計測のテストクラス."""
+
+    def test_percentile(self):
+        """パーセンタイル計算のテスト"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([3, 1, 2], 100), 3)
+        self.assertEqual(percentile([], 50), 0)
+
+    def test_server_timing(self):
+        """ 計測有効時は、Server-Timingヘッダが返るかのテスト"""
+        editor.stats.enabled = True
+        cache.clear()
+        try:
+            response = self.client.get(reverse('dteditor2:home'))
+        finally:
+            editor.stats.enabled = False
+        self.assertIn('update_code;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+        # 一覧の作成は描画中に行われる
+        self.assertIn('tree;dur=', response['Server-Timing'])
+
+
+class TestBench(TestCase):
+    """ベンチマークコマンドのテストクラス."""
+
+    def test_bench(self):
+        """ 小さなファイル数でベンチマークを実行し、結果のJSONを確認"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = os.path.join(temp_dir, 'bench.json')
+            call_command(
+                'bench', flat_files=10, depth=3, files_per_level=2,
+                big_file_mb=1, repeat=1, output=output)
+            with open(output) as file:
+                result = json.load(file)
+        self.assertIn('home_round_trip', result['benchmarks'])
+        self.assertIn('home_round_trip_warm', result['benchmarks'])
+        self.assertIn('median', result['benchmarks']['tree_update_flat'])
+
+
+class TestProfiling(TestCase):
+    """プロファイルのテストクラス."""
+
+    def test_profile(self):
+        """ プロファイルが保存され、戻り値が返るかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.settings(EDITOR_PROFILE_DIR=temp_dir):
+                result = profiling.profile('test', sum, [1, 2, 3])
+                files = os.listdir(temp_dir)
+        self.assertEqual(result, 6)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('test-'))
+
+    def test_nested_profile(self):
+        """ プロファイル中のプロファイルと、古いプロファイルの削除のテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.settings(EDITOR_PROFILE_DIR=temp_dir):
+                result = profiling.profile(
+                    'outer', profiling.profile, 'inner', sum, [1, 2])
+                self.assertEqual(result, 3)
+                self.assertEqual(len(os.listdir(temp_dir)), 1)
+
+                with self.settings(EDITOR_PROFILE_KEEP=1):
+                    profiling.profile('last', sum, [])
+                files = os.listdir(temp_dir)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('last-'))
+
+    def test_request_profile(self):
+        """ ?profile=1 で、描画中の一覧の作成もプロファイルされるかのテスト"""
+        cache.clear()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.settings(EDITOR_PROFILE_DIR=temp_dir):
+                self.client.get(reverse('dteditor2:home'), {'profile': '1'})
+                path = os.path.join(temp_dir, os.listdir(temp_dir)[0])
+                functions = [
+                    func_name for _, _, func_name in pstats.Stats(path).stats]
+        self.assertIn('create', functions)
+        self.assertIn('render', functions)
+
+    def test_profile_not_in_links(self):
+        """ ?profile=1 が、ディレクトリ・ファイルのリンクに引き継がれないかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.settings(EDITOR_PROFILE_DIR=temp_dir):
+                response = self.client.get(
+                    reverse('dteditor2:home'), {'profile': '1'})
+        self.assertNotContains(response, 'profile=1')
+
+
+class TestFileOps(TestCase):
+    """バックグラウンドコピーのテストクラス."""
+
+    def test_copy_dir(self):
+        """ ディレクトリのコピーと、.partファイルからの再開のテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src')
+            dst = os.path.join(temp_dir, 'dst')
+            os.makedirs(os.path.join(src, 'sub'))
+            data = os.urandom(100000)
+            with open(os.path.join(src, 'sub', 'a.bin'), 'wb') as file:
+                file.write(data)
+
+            # 途中までコピーされた状態から再開
+            os.makedirs(os.path.join(dst, 'sub'))
+            with open(os.path.join(dst, 'sub', 'a.bin.part'), 'wb') as file:
+                file.write(data[:1000])
+
+            job = fileops.CopyJob(src, dst)
+            job.start().join()
+            with open(os.path.join(dst, 'sub', 'a.bin'), 'rb') as file:
+                copied = file.read()
+
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(copied, data)
+        self.assertEqual(job.copied_bytes, len(data))
+
+    def test_cp2_into_dir(self):
+        """ 既にあるディレクトリへは、中へコピーするかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src')
+            dst = os.path.join(temp_dir, 'dst')
+            os.makedirs(src)
+            os.makedirs(dst)
+            with open(os.path.join(src, 'a.txt'), 'w') as file:
+                file.write('a')
+            base_command.cp2(editor, src, dst).join()
+            self.assertEqual(os.listdir(dst), ['src'])
+            self.assertEqual(
+                os.listdir(os.path.join(dst, 'src')), ['a.txt'])
+
+            # 中断したコピーの続きなら、そのディレクトリへコピーする
+            resume = os.path.join(temp_dir, 'resume')
+            job = fileops.CopyJob(src, resume)
+            with mock.patch.object(job, 'copy_file'):
+                job.run()
+            base_command.cp2(editor, src, resume).join()
+            self.assertEqual(os.listdir(resume), ['a.txt'])
+
+    def test_move_incomplete(self):
+        """ コピーできなかったファイルがあれば、移動元を削除しないかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src')
+            os.makedirs(src)
+            for name in ('a.txt', 'b.txt'):
+                with open(os.path.join(src, name), 'w') as file:
+                    file.write(name)
+
+            job = fileops.CopyJob(src, os.path.join(temp_dir, 'dst'), True)
+            with mock.patch.object(job, 'copy_file'):
+                job.run()
+
+            self.assertEqual(job.status, 'error')
+            self.assertEqual(sorted(os.listdir(src)), ['a.txt', 'b.txt'])
+
+
+class TestDupes(TestCase):
+    """重複ファイル検索のテストクラス."""
+
+    def test_find_duplicates(self):
+        """ 同じ内容のファイルだけがグループになるかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = os.path.join(temp_dir, 'root')
+            os.makedirs(os.path.join(root, 'sub'))
+            big = os.urandom(300 * 1024)
+            contents = {
+                'a.txt': b'same',
+                'sub/b.txt': b'same',
+                'c.txt': b'diff',
+                'big1.bin': big,
+                'sub/big2.bin': big,
+                'big3.bin': big[:-1] + b'x',
+            }
+            for name, content in contents.items():
+                with open(os.path.join(root, name), 'wb') as file:
+                    file.write(content)
+
+            cache_path = os.path.join(temp_dir, 'cache.json')
+            duplicates = find_duplicates(root, cache_path, 2)
+            # 2回目はキャッシュを使う
+            self.assertEqual(find_duplicates(root, cache_path, 2), duplicates)
+
+        self.assertEqual(duplicates, [
+            (len(big), [
+                os.path.join(root, 'big1.bin'),
+                os.path.join(root, 'sub', 'big2.bin'),
+            ]),
+            (4, [
+                os.path.join(root, 'a.txt'),
+                os.path.join(root, 'sub', 'b.txt'),
+            ]),
+        ])
+
+
+class TestCommand(TestCase):
+    """コマンド登録のテストクラス."""
+
+    def test_loaded_at_startup(self):
+        """ 起動時にコマンドが登録されているかのテスト"""
+        self.assertTrue(editor.command.loaded)
+        self.assertIn('save', editor.command.base_command_dict)
+        self.assertIn('now', editor.command.user_command_dict)
+
+    def test_command_info(self):
+        """ コマンドの説明と行番号のテスト"""
+        info = editor.command.base_command_list[0]
+        self.assertEqual(info.name, 'save')
+        self.assertTrue(info.doc.startswith('プログラムの保存を行う.'))
+        self.assertEqual(info.lineno, inspect.getsourcelines(info.func)[1])
+
+
+class TestBuffers(TestCase):
+    """バッファのテストクラス."""
+
+    def test_lru(self):
+        """ 上限を超えると、変更のない古いバッファから削除されるかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [os.path.join(temp_dir, f'{i}.txt') for i in range(3)]
+            for path in paths:
+                with open(path, 'w') as file:
+                    file.write('x' * 10)
+            cache = BufferCache(25)
+            for path in paths[:2]:
+                cache.add(path, 'x' * 10, os.path.getmtime(path), 'utf-8')
+
+            # ファイルが更新されていなければ、キャッシュから返る
+            self.assertIsNotNone(cache.get(paths[0], 'utf-8'))
+            self.assertIsNone(cache.get(paths[0], 'shift_jis'))
+
+            # 変更のあるバッファは、上限を超えても削除しない
+            cache.add(paths[0], 'x' * 10, os.path.getmtime(paths[0]), 'utf-8')
+            cache.update(paths[0], 'y' * 10)
+            cache.add(paths[2], 'x' * 10, os.path.getmtime(paths[2]), 'utf-8')
+            self.assertIn(paths[0], cache)
+            self.assertNotIn(paths[1], cache)
+            self.assertFalse(cache.remove(paths[0]))
+            self.assertTrue(cache.remove(paths[0], force=True))
+
+    @mock.patch.multiple(
+        editor, opening_file='', file_name='', file_extension='',
+        file_type='', code='')
+    def test_switch_file(self):
+        """ ファイルを切り替えても、保存していない変更が残るかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [os.path.join(temp_dir, f'{i}.py') for i in range(2)]
+            for path in paths:
+                with open(path, 'w') as file:
+                    file.write('print(1)')
+            url = reverse('dteditor2:home')
+            self.client.get(url, {'opening_file': paths[0]})
+            self.client.post(
+                f'{url}?opening_file={paths[1]}',
+                {'code': 'print(2)', 'code_file': paths[0], 'cmd': ''})
+            response = self.client.get(url, {'opening_file': paths[0]})
+            for path in paths:
+                editor.buffers.remove(path, force=True)
+        self.assertEqual(response.context['editor'].code, 'print(2)')
+
+    @mock.patch.multiple(
+        editor, opening_file='', file_name='', file_extension='',
+        file_type='', code='')
+    def test_post_code(self):
+        """ 改行コードだけの違いは変更とせず、バッファがなければ作り直すかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [os.path.join(temp_dir, f'{i}.py') for i in range(2)]
+            for path in paths:
+                with open(path, 'w') as file:
+                    file.write('a = 1\nb = 2\n')
+            url = reverse('dteditor2:home')
+            self.client.get(url, {'opening_file': paths[0]})
+            self.client.post(url, {
+                'code': 'a = 1\r\nb = 2\r\n', 'code_file': paths[0],
+                'cmd': ''})
+            self.assertFalse(editor.buffers.buffers[paths[0]].dirty)
+
+            # 開いていないファイルの変更も、バッファに残る
+            self.client.post(url, {
+                'code': 'a = 3\r\n', 'code_file': paths[1], 'cmd': ''})
+            buf = editor.buffers.buffers[paths[1]]
+            self.assertEqual(buf.code, 'a = 3\r\n')
+            self.assertTrue(buf.dirty)
+            for path in paths:
+                editor.buffers.remove(path, force=True)
+
+
+class TestHistory(TestCase):
+    """コマンド履歴のテストクラス."""
+
+    def test_history(self):
+        """ 重複の削除、最大件数、検索、再読み込みのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'history')
+            history = CommandHistory(path, 3)
+            for cmd in ['git status', 'ls', 'git log', 'ls', 'git diff']:
+                history.add(cmd)
+            self.assertEqual(list(history), ['git log', 'ls', 'git diff'])
+            self.assertEqual(history.search('git'), ['git diff', 'git log'])
+            self.assertEqual(history.search('gd', mode='fuzzy'), ['git diff'])
+            self.assertEqual(history.search(limit=2), ['git diff', 'ls'])
+
+            reloaded = CommandHistory(path, 3)
+            self.assertEqual(list(reloaded), list(history))
+            self.assertEqual(reloaded.search('git'), ['git diff', 'git log'])
+
+    def test_search_while_adding(self):
+        """ コマンドの追加中に検索しても、エラーにならないかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            history = CommandHistory(os.path.join(temp_dir, 'history'), 50)
+            thread = threading.Thread(
+                target=lambda: [history.add(f'ls {i}') for i in range(500)])
+            thread.start()
+            while thread.is_alive():
+                history.search('l', mode='fuzzy')
+                list(history)
+            thread.join()
+        self.assertEqual(len(history), 50)
+
+    def test_history_view(self):
+        """ /history アクセスのテスト"""
+        response = self.client.get(reverse('dteditor2:history'), {'q': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('commands', response.json())
+
+
+class TestTransfer(TestCase):
+    """アップロード・ダウンロードのテストクラス."""
+
+    def test_upload(self):
+        """ 分割アップロードと、ハッシュの確認のテスト"""
+        url = reverse('dteditor2:upload')
+        data = os.urandom(3000)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            params = f'dir={temp_dir}&name=a.bin'
+            response = self.client.post(
+                f'{url}?{params}&offset=0'
+                f'&sha256={hashlib.sha256(data[:1000]).hexdigest()}',
+                data[:1000], content_type='application/octet-stream')
+            self.assertEqual(response.json()['offset'], 1000)
+
+            # 壊れたチャンクは書き込まれない
+            response = self.client.post(
+                f'{url}?{params}&offset=1000&sha256=broken',
+                data[1000:], content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 400)
+
+            # 中断後は、届いているバイト数から再開
+            response = self.client.get(f'{url}?{params}')
+            self.assertEqual(response.json()['offset'], 1000)
+            self.client.post(
+                f'{url}?{params}&offset=1000',
+                data[1000:], content_type='application/octet-stream')
+            response = self.client.post(f'{url}?{params}&complete=1&size=3000')
+            self.assertEqual(response.status_code, 200)
+            with open(os.path.join(temp_dir, 'a.bin'), 'rb') as file:
+                self.assertEqual(file.read(), data)
+
+            # 0バイトのファイルは、完了だけが送られる
+            response = self.client.post(
+                f'{url}?dir={temp_dir}&name=empty.txt&complete=1&size=0')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                os.path.getsize(os.path.join(temp_dir, 'empty.txt')), 0)
+
+    def test_download_range(self):
+        """ Rangeヘッダでのダウンロードのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'a.txt')
+            with open(path, 'wb') as file:
+                file.write(b'0123456789')
+            url = reverse('dteditor2:download', kwargs={'path': path})
+
+            response = self.client.get(url)
+            content = b''.join(response.streaming_content)
+            self.assertEqual(content, b'0123456789')
+
+            response = self.client.get(url, HTTP_RANGE='bytes=2-4')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+            self.assertEqual(b''.join(response.streaming_content), b'234')
+
+            response = self.client.get(url, HTTP_RANGE='bytes=20-')
+            self.assertEqual(response.status_code, 416)
+
+    def test_content_disposition(self):
+        """ 日本語と"を含むファイル名のContent-Dispositionのテスト"""
+        self.assertEqual(
+            views.get_content_disposition('メモ "1".txt'),
+            'attachment; filename="__ _1_.txt"; '
+            "filename*=UTF-8''%E3%83%A1%E3%83%A2%20%221%22.txt")
+
+
+class TestRevisions(TestCase):
+    """リビジョンのテストクラス."""
+
+    def test_record_and_gc(self):
+        """ 記録・復元と、古いリビジョンの削除のテスト"""
+        lines = [f'print({i})\n'.encode() for i in range(10000)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = RevisionStore(temp_dir, 2, 0)
+            first = store.record('a.py', b''.join(lines), 'utf-8')
+            self.assertIsNone(store.record('a.py', b''.join(lines), 'utf-8'))
+
+            # 1行の変更では、チャンクは少しだけ増える
+            lines[5000] = b'print("changed")\n'
+            second = store.record('a.py', b''.join(lines), 'utf-8')
+            new_chunks = set(second['chunks']) - set(first['chunks'])
+            self.assertLess(len(new_chunks), 3)
+            self.assertEqual(store.find('a.py', first['id'][:8]), first)
+
+            lines[0] = b'print("changed")\n'
+            store.record('a.py', b''.join(lines), 'utf-8')
+            store.gc()
+            revisions = store.revisions('a.py')
+            self.assertEqual(len(revisions), 2)
+            self.assertEqual(store.load(revisions[0]), b''.join(lines))
+            self.assertEqual(store.load(revisions[1]).count(b'changed'), 1)
+
+    @mock.patch.multiple(editor, open_encoding='utf-8', code='')
+    def test_restore_encoding(self):
+        """ 保存した時のエンコーディングで復元するかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'a.txt')
+            store = RevisionStore(os.path.join(temp_dir, 'revisions'), 2, 0)
+            data = 'あいう'.encode('shift_jis')
+            revision = store.record(path, data, 'shift_jis')
+            with mock.patch.multiple(
+                    editor, revisions=store, opening_file=path):
+                base_command.restore(editor, revision['id'])
+        self.assertEqual(editor.code, 'あいう')
+
+
+@skipIf(django.VERSION < (4, 2), '非同期ビューはDjango 4.2以上')
+class TestAsyncViews(TestCase):
+    """非同期ビューのテストクラス."""
+
+    def test_history(self):
+        """ 非同期ビューから、同期ビューを呼び出せるかのテスト"""
+        from asgiref.sync import async_to_sync
+        from dteditor2 import async_views
+
+        request = RequestFactory().get('/history/')
+        response = async_to_sync(async_views.history)(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('commands', json.loads(response.content))
+
+    def test_img_and_download(self):
+        """ 画像の表示と、ダウンロードの非同期ビューのテスト"""
+        from asgiref.sync import async_to_sync
+        from dteditor2 import async_views
+
+        async def read_content(response):
+            return b''.join(
+                [chunk async for chunk in response.streaming_content])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'a.png')
+            with open(path, 'wb') as file:
+                file.write(b'0123456789')
+            factory = RequestFactory()
+            response = async_to_sync(async_views.img)(
+                factory.get('/img/'), path)
+            self.assertContains(response, 'MDEyMzQ1Njc4OQ==')
+
+            response = async_to_sync(async_views.download)(
+                factory.get('/download/', HTTP_RANGE='bytes=2-4'), path)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(async_to_sync(read_content)(response), b'234')
+
+    def test_output(self):
+        """ 出力エリアの配信が、続きから始まりタイムアウトで終わるかのテスト"""
+        from asgiref.sync import async_to_sync
+        from dteditor2 import async_views
+
+        async def read_events(response):
+            return [chunk async for chunk in response.streaming_content]
+
+        cmdpr.delete_cmd_log()
+        cmdpr.add_line('first')
+        cmdpr.add_line('second')
+        request = RequestFactory().get(
+            '/output/', {'since': 0}, HTTP_LAST_EVENT_ID='1')
+        with self.settings(EDITOR_SSE_TIMEOUT=0):
+            response = async_to_sync(async_views.output)(request)
+            events = async_to_sync(read_events)(response)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(events, [b'id: 2\ndata: "second"\n\n'])
+
+
+class TestScript(TestCase):
+    """スクリプト実行のテストクラス."""
+
+    def test_parse_script(self):
+        """ 改行・;・&&での分割と、クォートのテスト"""
+        self.assertEqual(parse_script('cd src && check\nsave; echo "a;b"'), [
+            (None, 'cd src'),
+            ('&&', 'check'),
+            (';', 'save'),
+            (';', 'echo "a;b"'),
+        ])
+
+    def setUp(self):
+        """実行したコマンドを、本来のコマンド履歴に残さない."""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        history = CommandHistory(os.path.join(temp_dir.name, 'history'), 10)
+        for target, name, value in [
+                (editor.command, 'command_history', history),
+                (editor, 'current_dir', editor.current_dir)]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_short_circuit(self):
+        """ 失敗したコマンドの後の&&は、実行されないかのテスト"""
+        current_dir = editor.current_dir
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # size2は引数がないので失敗し、cdは実行されない
+            editor.command.eval_script(f'size2 && cd {temp_dir}')
+            self.assertEqual(editor.current_dir, current_dir)
+
+            # ;の後は、前のコマンドが失敗しても実行される
+            editor.command.eval_script(f'size2; cd {temp_dir}')
+            self.assertEqual(editor.current_dir, temp_dir)
+
+    def test_shell_exit_status(self):
+        """ シェルのコマンドが失敗したら、&&の後が実行されないかのテスト"""
+        current_dir = editor.current_dir
+        with tempfile.TemporaryDirectory() as temp_dir:
+            editor.command.eval_script(f'exit 1 && cd {temp_dir}')
+            self.assertEqual(editor.current_dir, current_dir)
+
+            editor.command.eval_script(f'exit 0 && cd {temp_dir}')
+            self.assertEqual(editor.current_dir, temp_dir)
+
+    def test_command_history(self):
+        """ &&でつないだコマンドは、入力した1行で履歴に残るかのテスト"""
+        editor.command.eval_command('size2 && jobs')
+        self.assertEqual(
+            list(editor.command.command_history), ['size2 && jobs'])
+
+    def test_wait_copy(self):
+        """ cp2のコピーが終わってから、&&の後のrm2が実行されるかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src = os.path.join(temp_dir, 'src')
+            os.makedirs(os.path.join(src, 'sub'))
+            names = [os.path.join('sub', f'{i}.txt') for i in range(200)]
+            for name in names:
+                with open(os.path.join(src, name), 'w') as file:
+                    file.write(name)
+
+            editor.command.eval_script(
+                f'cd {temp_dir} && cp2 src dst && rm2 src')
+            copied = sorted(
+                os.path.join('sub', name)
+                for name in os.listdir(os.path.join(temp_dir, 'dst', 'sub')))
+            self.assertFalse(os.path.exists(src))
+        self.assertEqual(copied, sorted(names))
+
+
+class TestFragmentCache(TestCase):
+    """画面の一部のキャッシュのテストクラス."""
+
+    def test_tree_cached(self):
+        """ 変更がなければ、2回目はディレクトリ一覧を作成しないかのテスト"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            url = reverse('dteditor2:home')
+            params = {'current_dir': temp_dir}
+            self.client.get(url, params)
+            response = self.client.get(url, params)
+            self.assertIsNone(editor.tree._files)
+            version = editor.tree.version
+
+            # ファイルを追加すると、一覧を作り直す
+            time.sleep(0.01)
+            with open(os.path.join(temp_dir, 'new.txt'), 'w') as file:
+                file.write('new')
+            response = self.client.get(url, params)
+            self.assertNotEqual(editor.tree.version, version)
+            self.assertContains(response, 'new.txt')
+        editor.current_dir = settings.BASE_DIR
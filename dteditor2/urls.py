@@ -1,8 +1,28 @@
-from django.conf.urls import url
+from django.conf import settings
+try:
+    from django.urls import re_path as url
+except ImportError:  # Django 1.11
+    from django.conf.urls import url
 from . import views
 
 app_name = 'dteditor2'
 urlpatterns = [
     url(r'^$', views.home, name='home'),
+    url(r'^history/$', views.history, name='history'),
+    url(r'^upload/$', views.UploadView.as_view(), name='upload'),
+    url(r'^download/(?P<path>.*)/$', views.download, name='download'),
     url(r'^img/(?P<path>.*)/$', views.ImgView.as_view(), name='img'),
 ]
+
+# ASGIで動かす場合は、非同期ビューと出力エリアの配信を使う
+if settings.EDITOR_ASYNC:
+    from . import async_views
+    urlpatterns = [
+        url(r'^$', async_views.home, name='home'),
+        url(r'^history/$', async_views.history, name='history'),
+        url(r'^upload/$', async_views.upload, name='upload'),
+        url(r'^download/(?P<path>.*)/$', async_views.download,
+            name='download'),
+        url(r'^img/(?P<path>.*)/$', async_views.img, name='img'),
+        url(r'^output/$', async_views.output, name='output'),
+    ]
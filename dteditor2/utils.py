@@ -1,14 +1,24 @@
 """エディタを管理するモジュール."""
 from datetime import datetime
+import hashlib
+from importlib import import_module
 import inspect
+import locale
 import os
+import subprocess
 import sys
+import time
 
 import cmdpr
 from django.conf import settings
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
+from .buffers import BufferCache
+from .history import CommandHistory
+from .revisions import RevisionStore
+from .stats import Stats
+
 SUFFIXES = {
     1000: ['KB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB', 'YB'],
     1024: ['KiB', 'MiB', 'GiB', 'TiB', 'PiB', 'EiB', 'ZiB', 'YiB']
@@ -74,6 +84,18 @@ class Path:
         else:
             self.name = name
 
+    def get_query(self, **params):
+        """リンク先のクエリ文字列を、今のクエリにparamsを加えて作成する.
+
+        ?profile=1 は、リンク先に引き継ぎません。
+
+        """
+        query = self.editor.request.GET.copy()
+        query.pop('profile', None)
+        for key, value in params.items():
+            query[key] = value
+        return query.urlencode()
+
 
 class File(Path):
     """ファイルを表すクラス."""
@@ -102,15 +124,21 @@ class File(Path):
         # 画像、動画以外のファイルは、普段どおりのエディタで開く
         else:
             href = reverse('dteditor2:home')
-            param = self.editor.request.GET.copy()
-            param['opening_file'] = self.path
-            param = param.urlencode()
+            param = self.get_query(opening_file=self.path)
             tag = (
-                '<a data-toggle="tooltip" '
+                '<a class="buffer-link" data-toggle="tooltip" '
                 'data-placement="right" '
                 f'title="{change_bytes(self.size)} - {self.last_update}" '
                 f'href="{href}?{param}">{self.name}</a>'
             )
+
+        # ダウンロード用のaタグ
+        download_href = reverse(
+            'dteditor2:download', kwargs={'path': self.path})
+        tag += (
+            ' <a class="download-link" title="download" '
+            f'href="{download_href}">&#8681;</a>'
+        )
         return mark_safe(tag)
 
 
@@ -126,13 +154,17 @@ class Directory(Path):
     def create_a_tag(self):
         """aタグの作成."""
         href = reverse('dteditor2:home')
-        param = self.editor.request.GET.copy()
-        param['current_dir'] = self.path
-        param = param.urlencode()
-        tag = f'<a href="{href}?{param}">{self.name}</a>'
+        param = self.get_query(current_dir=self.path)
+        tag = (
+            f'<a class="buffer-link" href="{href}?{param}">{self.name}</a>')
         return mark_safe(tag)
 
 
+def get_version(*values):
+    """valuesから、テンプレートのフラグメントキャッシュのキーに使う文字列を作る."""
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
 class Tree:
     """エディタのディレクトリツリー作成クラス."""
 
@@ -141,13 +173,54 @@ class Tree:
         self.editor = editor
         self.sort_type = 'name'
         self.reverse = False
-        self.dirs = []
-        self.files = []
+        self.version = ''
+        self.generation = 0  # エディタからファイルを変更したら増やす
+        self._dirs = None
+        self._files = None
+
+    @property
+    def dirs(self):
+        """ディレクトリの一覧。初めて使われた時に作成する."""
+        if self._dirs is None:
+            self.create()
+        return self._dirs
+
+    @property
+    def files(self):
+        """ファイルの一覧。初めて使われた時に作成する."""
+        if self._files is None:
+            self.create()
+        return self._files
+
+    def touch(self):
+        """エディタからファイルを変更した時に呼び、一覧のキャッシュを無効にする."""
+        self.generation += 1
 
     def update(self):
-        """ディレクトリ、ファイルの一覧を返す."""
+        """一覧のバージョンを更新する.
+
+        一覧自体は、キャッシュされていない時にテンプレートから使われて作成されます。
+        ディレクトリ内のファイルの追加・削除は、ディレクトリの更新日時で判断します。
+
+        """
+        stat = os.stat(self.editor.current_dir)
+        self.version = get_version(
+            self.editor.current_dir, stat.st_mtime_ns, self.sort_type,
+            self.reverse, self.editor.request.GET.urlencode(),
+            self.generation,
+        )
+        self._dirs = None
+        self._files = None
+
+    def create(self):
+        """ディレクトリ、ファイルの一覧を作成する."""
+        with self.editor.stats.phase('tree'):
+            self._create()
+
+    def _create(self):
         # ディレクトリや全てのファイルの名前が入る
         files_and_dirs = os.listdir(self.editor.current_dir)
+        self.editor.stats.count('entries', len(files_and_dirs))
 
         # dirnameで前のフォルダを表せます
         before_dir = Directory(
@@ -177,8 +250,71 @@ class Tree:
         elif self.sort_type == 'update':
             files.sort(key=lambda file: file.last_update, reverse=self.reverse)
 
-        self.files = files
-        self.dirs = dirs
+        self._files = files
+        self._dirs = dirs
+
+
+def parse_script(script):
+    """スクリプトを、(演算子, コマンド)のリストに分割する.
+
+    演算子は、そのコマンドの前にある「&&」か「;」(改行は「;」)です。
+    最初のコマンドの演算子はNoneになります。
+    クォートで囲まれた中の&&や;では区切りません。
+
+    """
+    steps = []
+    operator = None
+    current = []
+    quote = None
+    i = 0
+    while i < len(script):
+        char = script[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ('"', "'"):
+            quote = char
+        elif char in (';', '\n') or script.startswith('&&', i):
+            cmd = ''.join(current).strip()
+            if cmd:
+                steps.append((operator, cmd))
+                operator = '&&' if char == '&' else ';'
+            elif char == '&':
+                # 「; && cmd」のように、コマンドがない場合も&&は引き継ぐ
+                operator = '&&'
+            current = []
+            i += 2 if char == '&' else 1
+            continue
+        current.append(char)
+        i += 1
+
+    cmd = ''.join(current).strip()
+    if cmd:
+        steps.append((operator, cmd))
+    return steps
+
+
+class CommandInfo:
+    """登録されたコマンドの、画面右に表示する情報."""
+
+    def __init__(self, name, func):
+        """初期化."""
+        self.name = name
+        self.func = func
+
+    @property
+    def doc(self):
+        """コマンドの説明."""
+        return inspect.getdoc(self.func) or ''
+
+    @property
+    def lineno(self):
+        """コマンドが定義された行番号.
+
+        ソースファイルは読まずに、コードオブジェクトの行番号を使います。
+
+        """
+        return inspect.unwrap(self.func).__code__.co_firstlineno
 
 
 class Command:
@@ -187,80 +323,202 @@ class Command:
     def __init__(self, editor):
         """初期化."""
         self.editor = editor
-        self.command_history = []
+        self.command_history = CommandHistory(
+            settings.EDITOR_HISTORY_FILE, settings.EDITOR_HISTORY_SIZE)
         self.base_command_dict = {}
         self.base_command_list = []
         self.user_command_dict = {}
         self.user_command_list = []
         self.output = ''
-        self.first = True
+        self.loaded = False
+        self.in_script = False  # スクリプトの実行中かどうか
+        self._version = None
 
     def register(self, func):
         """関数を登録するデコレータとして利用してね."""
         name = func.__name__
-        doc = inspect.getdoc(func) or ''
-        source_file = inspect.getsourcefile(func)
-        lineno = inspect.getsourcelines(func)[1]
-
-        # ユーザー定義用モジュールならuser_command_dict,listへ
-        if os.path.basename(source_file) == 'user_command.py':
-            self.user_command_dict[name] = func
-            self.user_command_list.append((name, doc, lineno))
+        info = CommandInfo(name, func)
+        self._version = None
 
-        # そうでなければbase_command_dict,listへ
-        elif os.path.basename(source_file) == 'base_command.py':
+        # このアプリのモジュールならbase_command_dict,listへ
+        if func.__module__ == 'dteditor2.base_command':
             self.base_command_dict[name] = func
-            self.base_command_list.append((name, doc, lineno))
+            self.base_command_list.append(info)
+
+        # そうでなければ、ユーザー定義としてuser_command_dict,listへ
+        else:
+            self.user_command_dict[name] = func
+            self.user_command_list.append(info)
 
         return func
 
+    @property
+    def version(self):
+        """登録されたコマンドが変われば変わる、フラグメントキャッシュ用の文字列."""
+        if self._version is None:
+            self._version = get_version([
+                (info.func.__module__, info.name, info.lineno, info.doc)
+                for info in self.base_command_list + self.user_command_list
+            ])
+        return self._version
+
+    def load_commands(self):
+        """コマンド登録用モジュールを読み込む.
+
+        アプリの起動時(AppConfig.ready)に呼ばれます。
+        一度読み込めばそれでOK。registerで登録してくれる
+
+        """
+        if self.loaded:
+            return
+        import_module('dteditor2.base_command')
+        for module_name in settings.EDITOR_COMMAND_MODULES:
+            import_module(module_name)
+        self.loaded = True
+
     def eval_command(self, cmd):
         """入力されたコマンドを評価する.
 
         project.user_command.py(ユーザー定義) dteditor2.base_command.py（もともとの）
         DOSなどの元々のコマンド の順で、コマンド名を探す
 
+        「cd src && check」のように、登録されたコマンドを&&や;でつないだ場合は
+        スクリプトとして1つずつ実行する
+
+        """
+        # 同じコマンドは、ヒストリーの中で1つにまとめられる
+        self.command_history.add(cmd)
+
+        steps = parse_script(cmd)
+        if len(steps) > 1 and any(
+                self.get_function(step.split()[0]) for _, step in steps):
+            self.eval_script(cmd, add_history=False)
+        else:
+            self.execute(cmd)
+
+    def eval_script(self, script, add_history=True):
+        """複数のコマンドを、順番に実行する.
+
+        改行か;で区切ったコマンドは、前のコマンドが失敗しても実行します。
+        &&でつないだコマンドは、前のコマンドが失敗したら実行しません。
+        シェルのコマンドとcp2・mv2のバックグラウンドのコピーは、
+        終わるのを待ち、成功したかどうかを確認してから次へ進みます。
+        それぞれのコマンドの結果と処理時間を、出力エリアに表示します。
+
+        引数:
+            script: コマンドを改行・;・&&でつないだ文字列
+            add_history: Trueなら、それぞれのコマンドをコマンド履歴に追加する
+
+        """
+        steps = parse_script(script)
+        success = True
+        self.in_script = True
+        try:
+            for number, (operator, cmd) in enumerate(steps, 1):
+                head = f'[{number}/{len(steps)}]'
+                if operator == '&&' and not success:
+                    cmdpr.add_line(f'{head} skip {cmd}')
+                    continue
+
+                if add_history:
+                    self.command_history.add(cmd)
+                start = time.perf_counter()
+                try:
+                    success = self.execute(cmd)
+                except Exception as e:
+                    cmdpr.add_line(f'エラーが発生しました {e!r}')
+                    success = False
+                duration = (time.perf_counter() - start) * 1000
+                result = 'ok' if success else 'failed'
+                cmdpr.add_line(f'{head} {result} {duration:.1f}ms {cmd}')
+        finally:
+            self.in_script = False
+
+    def get_function(self, command_name):
+        """登録されたコマンドの関数を返す。なければNone."""
+        # ユーザー定義 or このモジュール
+        return self.user_command_dict.get(
+            command_name) or self.base_command_dict.get(command_name)
+
+    def execute(self, cmd):
+        """コマンドを実行する。コマンド履歴には追加しない.
+
+        引数が一致しない時や、コマンドの関数がFalseを返した時はFalseを返します。
+
+        スクリプトの中では、シェルのコマンドは終了コードで成否を返します。
+        コマンドの関数がcp2等のバックグラウンドのジョブを返した場合は、
+        ジョブの終了を待ち、ジョブが成功したかどうかを返します。
+        スクリプトの外では、シェルのコマンドは常にTrueを返します。
+
         """
-        # 最後に入力したコマンドと、今のコマンドが同じならヒストリーに追加しない
-        last_comand = self.command_history[-1] if self.command_history else ''
-        if not cmd == last_comand:
-            self.command_history.append(cmd)
         commands = cmd.split()
+        if not commands:
+            return True
         command_name = commands[0]
         command_args = commands[1:]
 
-        # ユーザー定義 or このモジュール
-        function = self.user_command_dict.get(
-            command_name) or self.base_command_dict.get(command_name)
+        function = self.get_function(command_name)
 
         if function:
             try:
-                function(self.editor, *command_args)
+                result = function(self.editor, *command_args)
             except TypeError as e:
                 cmdpr.add_line(f'引数が一致しません {e}')
+                return False
+            if self.in_script and hasattr(result, 'join'):
+                return result.join()
+            return result is not False
 
         # このモジュールにコマンドがとうろく登録されていない
+        elif self.in_script:
+            return self.run_cmd(cmd)
         else:
             # cd でディレクトリをエディタと同期
-            cmdpr.run_cmd(f'cd {self.editor.current_dir}')
+            self.run_cmd(f'cd {self.editor.current_dir}')
+            self.run_cmd(cmd)
+        return True
+
+    def run_cmd(self, cmd):
+        """シェルのコマンドを実行し、サブプロセス数を数える.
+
+        通常はcmdpr.run_cmdで実行し、終了コードは取得できないのでNoneを返します。
+        スクリプトの中では、&&の後を実行するか決めるためにカレントディレクトリで
+        終了まで待って実行し、終了コードが0ならTrue、それ以外はFalseを返します。
+
+        """
+        self.editor.stats.count('subprocess')
+        if not self.in_script:
             cmdpr.run_cmd(cmd)
+            return None
+
+        process = subprocess.run(
+            cmd, shell=True, cwd=self.editor.current_dir,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.stdout.decode(
+            locale.getpreferredencoding(False), errors='replace')
+        for line in output.splitlines():
+            cmdpr.add_line(line)
+        return process.returncode == 0
 
     def update(self):
         """コマンドが入力されていれば実行し、最新の出力を取得する."""
-        # 初回だけ、コマンド登録用モジュールを読み込む
-        # 一度読み込めばそれでOK。registerで登録してくれる
-        if self.first:
-            from importlib import import_module
-            import_module('dteditor2.base_command')
-            import_module('project.user_command')
-            self.first = False
+        # 通常はアプリの起動時に読み込み済み
+        self.load_commands()
+
+        # スクリプトの入力があれば実行
+        script = self.editor.request.POST.get('script', '')
+        if script.strip():
+            self.eval_script(script)
 
         # コマンドの入力があれば実行
         cmd = self.editor.request.POST.get('cmd', '')
         if cmd:
             self.eval_command(cmd)
 
-        # 現在の出力の取得
+        self.update_output()
+
+    def update_output(self):
+        """現在の出力の取得."""
         self.output = cmdpr.get_output(0)
 
 
@@ -282,35 +540,86 @@ class Editor:
         self.code = ''
         self.tree = Tree(self)
         self.command = Command(self)
+        self.stats = Stats()
+        self.fragment_cache_timeout = settings.EDITOR_FRAGMENT_CACHE_TIMEOUT
+        self.buffers = BufferCache(settings.EDITOR_BUFFER_CACHE_SIZE)
+        self.revisions = RevisionStore(
+            settings.EDITOR_REVISION_DIR,
+            settings.EDITOR_REVISION_KEEP,
+            settings.EDITOR_REVISION_GC_INTERVAL,
+        )
+
+    @property
+    def settings_version(self):
+        """設定の表示内容が変われば変わる、フラグメントキャッシュ用の文字列."""
+        return get_version(
+            self.opening_file, self.file_name, self.file_type,
+            self.current_dir, self.file_extension, self.tree.sort_type,
+            self.tree.reverse, self.open_encoding, self.save_encoding,
+            self.editor_python_path, self.editor_project_path,
+        )
 
     def update(self, request):
         """エディタの更新."""
         self.request = request
-        self.update_dir()
-        self.update_file()
-        self.update_code()
-        self.command.update()
-        self.tree.update()
+        self.stats.begin()
+        with self.stats.phase('update_dir'):
+            self.update_dir()
+        with self.stats.phase('update_file'):
+            self.update_file()
+        with self.stats.phase('update_code'):
+            self.update_code()
+        with self.stats.phase('command'):
+            self.command.update()
+        # 一覧の作成は、描画中にtreeフェーズとして計測される
+        with self.stats.phase('tree_version'):
+            self.tree.update()
 
     def update_code(self):
         """エディタのコードを更新."""
-        # ファイル、ディレクトリクリック等のGETアクセス時は
-        # 開いているファイルのコードを読み込む
+        # Send Command が押された時等は、送られてきたコードを
+        # そのコードのファイルのバッファへ反映。特にSave 時に変更コードを取得するため
         post_code = self.request.POST.get('code')
-        if not post_code:
-            try:
-                code = open(self.opening_file, 'rb').read()
-                code = code.decode(self.open_encoding)
-            except FileNotFoundError:
-                code = 'ファイルが見つかりませんでした'
-            except UnicodeDecodeError:
-                code = f'{self.open_encoding}でデコードできませんでした'
-            finally:
-                self.code = code
-
-        # Send Command が押されたらここ。特にSave 時に変更コードを取得するため
+        code_file = self.request.POST.get('code_file', self.opening_file)
+        if post_code:
+            # 上限で削除された等でバッファがなければ、作り直してから反映する
+            if code_file and code_file not in self.buffers:
+                self.read_file(code_file)
+                if code_file not in self.buffers:
+                    self.buffers.add(code_file, '', None, self.open_encoding)
+            self.buffers.update(code_file, post_code)
+            if code_file == self.opening_file:
+                self.code = post_code
+                return
+
+        # ファイル、ディレクトリクリック等のGETアクセス時
+        self.load_code()
+
+    def load_code(self):
+        """開いているファイルのコードを、バッファかファイルから読み込む."""
+        buf = self.buffers.get(self.opening_file, self.open_encoding)
+        if buf:
+            self.code = buf.code
         else:
-            self.code = post_code
+            self.code = self.read_file(self.opening_file)
+
+    def read_file(self, file_path):
+        """ファイルを読み込んでバッファに追加し、コードを返す.
+
+        読み込めなかった場合は、バッファに追加せずにメッセージを返します。
+
+        """
+        try:
+            mtime = os.path.getmtime(file_path)
+            code = open(file_path, 'rb').read()
+            self.stats.count('bytes_read', len(code))
+            code = code.decode(self.open_encoding)
+        except FileNotFoundError:
+            return 'ファイルが見つかりませんでした'
+        except UnicodeDecodeError:
+            return f'{self.open_encoding}でデコードできませんでした'
+        self.buffers.add(file_path, code, mtime, self.open_encoding)
+        return code
 
     def update_file(self, file_path=None):
         """開いているファイルの更新."""
@@ -1,19 +1,70 @@
 import base64
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
 
-from django.http import Http404
+import cmdpr
+from django.conf import settings
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import render
 from django.views import generic
 
+from . import profiling
 from .utils import editor
 
 
 def home(request):
     """/ アクセスで呼び出されるビュー."""
-    editor.update(request)  # エディタの更新
+    # ?profile=1 等の時は、描画までのプロファイルを取って出力エリアに表示
+    if profiling.is_enabled(request):
+        profiling.profile('request', render_home, request)
+
+        # プロファイルの結果を出力エリアに表示するため、もう一度描画する
+        editor.command.update_output()
+        return render(request, 'dteditor2/home.html', {'editor': editor})
+    return render_home(request)
+
+
+def render_home(request):
+    """エディタを更新し、画面を描画する.
+
+    ディレクトリ一覧は、キャッシュされていない時に描画の中で作成されます。
+
+    """
+    editor.update(request)
     context = {
         'editor': editor,
     }
-    return render(request, 'dteditor2/home.html', context)
+    with editor.stats.phase('render'):
+        response = render(request, 'dteditor2/home.html', context)
+
+    # 計測が有効なら、各フェーズの処理時間をServer-Timingヘッダへ
+    if editor.stats.enabled:
+        editor.stats.end()
+        response['Server-Timing'] = editor.stats.server_timing()
+    return response
+
+
+def history(request):
+    """/history コマンド履歴の検索で呼び出されるビュー.
+
+    ?q=git&mode=prefix: gitで始まるコマンドを新しい順に
+    ?q=gt&mode=fuzzy: g,tの順で文字を含むコマンドを新しい順に
+
+    """
+    query = request.GET.get('q', '')
+    mode = request.GET.get('mode', 'prefix')
+    try:
+        limit = int(request.GET.get('limit', 50))
+    except ValueError:
+        limit = 50
+    limit = max(0, min(limit, settings.EDITOR_HISTORY_SEARCH_LIMIT))
+    commands = editor.command.command_history.search(query, mode, limit)
+    return JsonResponse({'commands': commands})
 
 
 class ImgView(generic.TemplateView):
@@ -32,3 +83,192 @@ class ImgView(generic.TemplateView):
             context['img_src'] = base64.b64encode(src)
             context['img_path'] = img_path
             return context
+
+
+def read_file_range(file, start, length, chunk_size):
+    """fileのstartからlengthバイトを、chunk_sizeずつ返すジェネレータ."""
+    with file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def parse_range(header, size):
+    """Rangeヘッダを解釈し、(開始位置, 長さ)を返す.
+
+    「bytes=0-99」「bytes=100-」「bytes=-100」の形式に対応しています。
+    複数の範囲には対応せず、満たせない範囲の場合はNoneを返します。
+
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    start, end = match.groups()
+    if start == '':
+        # 末尾からのバイト数
+        length = min(int(end), size)
+        return (size - length, length) if length else None
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        return None
+    return start, end - start + 1
+
+
+def get_content_disposition(file_name):
+    """ダウンロードする時の、Content-Dispositionヘッダの値を返す.
+
+    日本語等のファイル名は、filename*にUTF-8でパーセントエンコードして入れます。
+    filename*に対応していないブラウザ向けのfilenameは、ASCII以外と"を_にしたものです。
+
+    """
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', '_', file_name)
+    return (
+        f'attachment; filename="{fallback}"; '
+        f"filename*=UTF-8''{quote(file_name, safe='')}")
+
+
+def download(request, path):
+    """/download/path ファイルのダウンロードで呼び出されるビュー.
+
+    ファイルは少しずつ読み込んで返し、Rangeヘッダでの途中からのダウンロードにも対応します。
+
+    """
+    return build_download_response(request, path, read_file_range)
+
+
+def build_download_response(request, path, read_range):
+    """ダウンロードのレスポンスを作成する.
+
+    引数:
+        path: ダウンロードするファイルのパス
+        read_range: read_file_rangeと同じ引数で、ファイルの内容を返す関数
+
+    """
+    try:
+        file = open(path, 'rb')
+    except (FileNotFoundError, IsADirectoryError):
+        raise Http404('file Not Found')
+
+    size = os.fstat(file.fileno()).st_size
+    start, length = 0, size
+    status = 200
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header:
+        file_range = parse_range(range_header, size)
+        if file_range is None:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        start, length = file_range
+        status = 206
+
+    content_type, _ = mimetypes.guess_type(path)
+    response = StreamingHttpResponse(
+        read_range(file, start, length, settings.EDITOR_TRANSFER_CHUNK_SIZE),
+        status=status,
+        content_type=content_type or 'application/octet-stream',
+    )
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = get_content_disposition(
+        os.path.basename(path))
+    if status == 206:
+        response['Content-Range'] = (
+            f'bytes {start}-{start + length - 1}/{size}')
+    return response
+
+
+class UploadView(generic.View):
+    """/upload ファイルの分割アップロードで呼び出されるビュー.
+
+    アップロード中のファイルは「名前.part」に書き込み、全て届いたら名前を変更します。
+    中断した場合は、GETで届いているバイト数を取得し、その続きから送ってください。
+
+    GET ?dir=ディレクトリ&name=ファイル名
+        届いているバイト数を返す
+    POST ?dir=ディレクトリ&name=ファイル名&offset=位置&sha256=ハッシュ
+        リクエストボディを、offsetの位置から書き込む
+        sha256があれば、書き込んだチャンクのハッシュを確認する
+    POST ?dir=ディレクトリ&name=ファイル名&complete=1&size=サイズ
+        アップロードを完了する
+
+    """
+
+    def get_target(self):
+        """アップロード先のパスを返す."""
+        directory = self.request.GET.get('dir', '')
+        name = self.request.GET.get('name', '')
+        if not os.path.isdir(directory):
+            raise Http404('directory Not Found')
+        if not name or os.path.basename(name) != name or name in ('.', '..'):
+            raise Http404('invalid file name')
+        return os.path.join(directory, name)
+
+    def get_offset(self, part):
+        """届いているバイト数を返す."""
+        try:
+            return os.path.getsize(part)
+        except FileNotFoundError:
+            return 0
+
+    def get(self, request, *args, **kwargs):
+        part = self.get_target() + '.part'
+        return JsonResponse({'offset': self.get_offset(part)})
+
+    def post(self, request, *args, **kwargs):
+        target = self.get_target()
+        part = target + '.part'
+        if request.GET.get('complete'):
+            return self.complete(target, part)
+
+        try:
+            offset = int(request.GET.get('offset', 0))
+        except ValueError:
+            return JsonResponse({'error': 'invalid offset'}, status=400)
+
+        # 届いているバイト数とずれていれば、正しい位置を返す
+        current = self.get_offset(part)
+        if offset != current:
+            return JsonResponse({'offset': current}, status=409)
+
+        digest = hashlib.sha256()
+        chunk_size = settings.EDITOR_TRANSFER_CHUNK_SIZE
+        with open(part, 'ab') as file:
+            for data in iter(lambda: request.read(chunk_size), b''):
+                digest.update(data)
+                file.write(data)
+
+            # チャンクが壊れていれば、書き込んだ分を取り消す
+            sha256 = request.GET.get('sha256')
+            if sha256 and sha256 != digest.hexdigest():
+                file.truncate(offset)
+                return JsonResponse(
+                    {'error': 'sha256 mismatch', 'offset': offset}, status=400)
+
+        return JsonResponse({'offset': self.get_offset(part)})
+
+    def complete(self, target, part):
+        """アップロードを完了し、.partファイルの名前を変更する."""
+        try:
+            size = int(self.request.GET.get('size', -1))
+        except ValueError:
+            size = -1
+        offset = self.get_offset(part)
+        if size != offset:
+            return JsonResponse(
+                {'error': 'size mismatch', 'offset': offset}, status=409)
+        if os.path.exists(target):
+            return JsonResponse({'error': 'file exists'}, status=409)
+
+        # 0バイトのファイルは、チャンクが送られないので.partファイルがない
+        if size == 0 and not os.path.exists(part):
+            open(part, 'wb').close()
+        os.replace(part, target)
+        cmdpr.add_line(f'アップロードしました {target}')
+        return JsonResponse({'offset': offset, 'path': target})
@@ -101,6 +101,17 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# エディタの画面の一部(ディレクトリ一覧、設定、コマンドの説明)のキャッシュに使う
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.10/topics/i18n/
 
@@ -135,3 +146,79 @@ FILE_TYPE = {
 
 # 登録されていない拡張子を開いたときのAceエディタのモード
 DEFAULT_ACE_TYPE = 'plain_text'
+
+# Trueにすると、エディタの処理時間・件数を計測し、Server-Timingヘッダを返す
+EDITOR_STATS = False
+
+# statsコマンドでパーセンタイルを計算する、直近のリクエスト数
+EDITOR_STATS_WINDOW = 1000
+
+# Trueにすると、全てのアクセスでプロファイルを取る。?profile=1 でもプロファイルできる
+EDITOR_PROFILE = False
+
+# プロファイルを保存するディレクトリ
+EDITOR_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# 出力エリアに表示する、処理時間の長い関数の数
+EDITOR_PROFILE_TOP = 20
+
+# 残しておくプロファイルの数。超えると古いものから削除する
+EDITOR_PROFILE_KEEP = 50
+
+# cp2, mv2でファイルをコピーするスレッド数
+EDITOR_COPY_WORKERS = 8
+
+# cp2, mv2の進捗を出力エリアに表示する間隔(秒)
+EDITOR_COPY_REPORT_INTERVAL = 2
+
+# この大きさ(バイト)以下のファイル1つのcp2は、バックグラウンドにせずその場で行う
+EDITOR_COPY_SYNC_SIZE = 8 * 1024 * 1024
+
+# dupesコマンドで計算したハッシュを保存するファイル
+EDITOR_DUPES_CACHE = os.path.join(BASE_DIR, '.dupes_cache.json')
+
+# dupesコマンドでハッシュを計算するスレッド数
+EDITOR_DUPES_WORKERS = 8
+
+# コマンドを登録するモジュール。dteditor2.base_commandは常に読み込まれる
+EDITOR_COMMAND_MODULES = [
+    'project.user_command',
+]
+
+# 開いたファイルの内容をメモリに保持する上限(文字数)
+# 保存されていない変更があるファイルは、上限を超えても保持する
+EDITOR_BUFFER_CACHE_SIZE = 64 * 1024 * 1024
+
+# コマンド履歴を保存するファイル
+EDITOR_HISTORY_FILE = os.path.join(BASE_DIR, '.command_history')
+
+# 保存するコマンド履歴の最大件数
+EDITOR_HISTORY_SIZE = 100000
+
+# コマンド履歴の検索で返す最大件数
+EDITOR_HISTORY_SEARCH_LIMIT = 1000
+
+# ファイルのアップロード・ダウンロードで、一度に読み書きするバイト数
+EDITOR_TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+# saveで保存したファイルのリビジョンを記録するディレクトリ
+EDITOR_REVISION_DIR = os.path.join(BASE_DIR, '.revisions')
+
+# ファイル毎に残すリビジョンの数
+EDITOR_REVISION_KEEP = 100
+
+# 古いリビジョンを削除する間隔(秒)。保存とは別のスレッドで行う
+EDITOR_REVISION_GC_INTERVAL = 600
+
+# Trueにすると、非同期ビューを使う。project.asgiで動かす場合に。Django 4.2以上
+EDITOR_ASYNC = False
+
+# 非同期ビューで、出力エリアの更新を確認する間隔(秒)
+EDITOR_SSE_INTERVAL = 0.5
+
+# 非同期ビューで、出力エリアを1回の接続で配信する秒数。過ぎるとブラウザが再接続する
+EDITOR_SSE_TIMEOUT = 30
+
+# エディタの画面の一部をキャッシュする秒数
+# エディタ以外からファイルの中身を変更した場合、この秒数の間はサイズ等の表示が古いまま
+EDITOR_FRAGMENT_CACHE_TIMEOUT = 60
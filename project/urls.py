@@ -13,8 +13,12 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
-from django.conf.urls import url, include
+from django.conf.urls import include
 from django.contrib import admin
+try:
+    from django.urls import re_path as url
+except ImportError:  # Django 1.11
+    from django.conf.urls import url
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),